@@ -0,0 +1,45 @@
+-- station x day and station x hour rental counts, maintained incrementally
+-- by bikemi_rentals.refresh_rentals_counts() (see the function file)
+CREATE TABLE IF NOT EXISTS bikemi_rentals.station_daily_counts
+(
+    numero_stazione     integer NOT NULL,
+    data_partenza       date    NOT NULL,
+    noleggi_giornalieri integer NOT NULL,
+    PRIMARY KEY (numero_stazione, data_partenza)
+);
+
+CREATE TABLE IF NOT EXISTS bikemi_rentals.station_hourly_counts
+(
+    numero_stazione integer   NOT NULL,
+    data_partenza   timestamp NOT NULL,
+    noleggi_per_ora integer   NOT NULL,
+    PRIMARY KEY (numero_stazione, data_partenza)
+);
+
+-- numbers the rentals in order of loading, so that a refresh finds the rows
+-- loaded since the last one whatever their pick-up time. Adding the column
+-- numbers the rentals already loaded; the loads (COPY included) leave it to
+-- the default.
+CREATE SEQUENCE IF NOT EXISTS bikemi_source_data_id_caricamento_seq;
+
+ALTER TABLE bikemi_source_data
+    ADD COLUMN IF NOT EXISTS id_caricamento bigint NOT NULL
+        DEFAULT nextval('bikemi_source_data_id_caricamento_seq');
+
+ALTER SEQUENCE bikemi_source_data_id_caricamento_seq
+    OWNED BY bikemi_source_data.id_caricamento;
+
+-- the last rental (by id_caricamento) already counted in the tables above
+CREATE TABLE IF NOT EXISTS bikemi_rentals.rentals_counts_watermark
+(
+    counts_table        text PRIMARY KEY,
+    last_id_caricamento bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO bikemi_rentals.rentals_counts_watermark (counts_table)
+VALUES ('station_counts')
+ON CONFLICT DO NOTHING;
+
+-- lets each refresh read only the rentals after the watermark
+CREATE INDEX IF NOT EXISTS bikemi_source_data_id_caricamento_idx
+    ON bikemi_source_data (id_caricamento);
@@ -0,0 +1,60 @@
+-- recomputes the station x hour and station x day counts of one month from
+-- its partition only, from the rentals up to the watermark (by load order) of
+-- refresh_rentals_counts(): the later ones are added by the next refresh.
+-- Months do not share rows, so several months can be rebuilt at the same
+-- time from different sessions (see data_access.rebuild_rentals_counts).
+-- Usage: SELECT bikemi_rentals.rebuild_rentals_counts('2016-03-01');
+CREATE OR REPLACE FUNCTION bikemi_rentals.rebuild_rentals_counts(first_day date)
+    RETURNS bigint
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    month_start   timestamp := DATE_TRUNC('month', first_day::timestamp);
+    month_end     timestamp := DATE_TRUNC('month', first_day::timestamp) + interval '1 month';
+    watermark     bigint;
+    rebuilt_hours bigint;
+BEGIN
+    -- a refresh cannot move the watermark during the rebuild
+    SELECT w.last_id_caricamento
+    INTO watermark
+    FROM bikemi_rentals.rentals_counts_watermark w
+    WHERE w.counts_table = 'station_counts'
+        FOR SHARE;
+
+    DELETE
+    FROM bikemi_rentals.station_hourly_counts
+    WHERE data_partenza >= month_start
+      AND data_partenza < month_end;
+
+    DELETE
+    FROM bikemi_rentals.station_daily_counts
+    WHERE data_partenza >= month_start::date
+      AND data_partenza < month_end::date;
+
+    INSERT INTO bikemi_rentals.station_hourly_counts (numero_stazione, data_partenza, noleggi_per_ora)
+    SELECT b.numero_stazione_prelievo,
+           b.ora_prelievo,
+           COUNT(*)
+    FROM bikemi_source_data b
+    WHERE b.data_prelievo >= month_start
+      AND b.data_prelievo < month_end
+      AND b.id_caricamento <= watermark
+      AND b.data_restituzione < timestamp '2019-01-01'
+      AND b.durata_noleggio > '00:01:00'::interval
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS rebuilt_hours = ROW_COUNT;
+
+    INSERT INTO bikemi_rentals.station_daily_counts (numero_stazione, data_partenza, noleggi_giornalieri)
+    SELECT h.numero_stazione,
+           h.data_partenza::date,
+           SUM(h.noleggi_per_ora)
+    FROM bikemi_rentals.station_hourly_counts h
+    WHERE h.data_partenza >= month_start
+      AND h.data_partenza < month_end
+    GROUP BY 1, 2;
+
+    RETURN rebuilt_hours;
+END;
+$$;
@@ -0,0 +1,76 @@
+-- adds the rentals loaded after the watermark (by id_caricamento, see
+-- before_2019-create_table-rentals_counts.sql) to the station x hour and
+-- station x day counts, and moves the watermark forward. The cost depends on
+-- the number of new rentals only, and rentals loaded late are counted
+-- whatever their pick-up time.
+-- Needs the ora_prelievo column (create_table-bikemi_rentals-pickup_buckets).
+-- Usage: SELECT bikemi_rentals.refresh_rentals_counts();
+CREATE OR REPLACE FUNCTION bikemi_rentals.refresh_rentals_counts()
+    RETURNS bigint
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    low_watermark  bigint;
+    high_watermark bigint;
+    new_rentals    bigint;
+BEGIN
+    -- the lock makes concurrent refreshes wait for each other
+    SELECT w.last_id_caricamento
+    INTO low_watermark
+    FROM bikemi_rentals.rentals_counts_watermark w
+    WHERE w.counts_table = 'station_counts'
+        FOR UPDATE;
+
+    -- ids are taken before the loads commit: the lock waits for the loads
+    -- in progress, so no id below the new watermark can appear afterwards
+    LOCK TABLE bikemi_source_data IN SHARE MODE;
+
+    SELECT MAX(b.id_caricamento)
+    INTO high_watermark
+    FROM bikemi_source_data b
+    WHERE b.id_caricamento > low_watermark;
+
+    IF high_watermark IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- the same filters as bikemi_rentals_before_2019
+    DROP TABLE IF EXISTS new_hourly_counts;
+    CREATE TEMPORARY TABLE new_hourly_counts ON COMMIT DROP AS
+    SELECT b.numero_stazione_prelievo AS numero_stazione,
+           b.ora_prelievo             AS data_partenza,
+           COUNT(*)                   AS noleggi
+    FROM bikemi_source_data b
+    WHERE b.id_caricamento > low_watermark
+      AND b.id_caricamento <= high_watermark
+      AND b.data_restituzione < timestamp '2019-01-01'
+      AND b.durata_noleggio > '00:01:00'::interval
+    GROUP BY 1, 2;
+
+    INSERT INTO bikemi_rentals.station_hourly_counts AS h
+        (numero_stazione, data_partenza, noleggi_per_ora)
+    SELECT n.numero_stazione, n.data_partenza, n.noleggi
+    FROM new_hourly_counts n
+    ON CONFLICT (numero_stazione, data_partenza) DO UPDATE
+        SET noleggi_per_ora = h.noleggi_per_ora + EXCLUDED.noleggi_per_ora;
+
+    INSERT INTO bikemi_rentals.station_daily_counts AS d
+        (numero_stazione, data_partenza, noleggi_giornalieri)
+    SELECT n.numero_stazione, n.data_partenza::date, SUM(n.noleggi)
+    FROM new_hourly_counts n
+    GROUP BY 1, 2
+    ON CONFLICT (numero_stazione, data_partenza) DO UPDATE
+        SET noleggi_giornalieri = d.noleggi_giornalieri + EXCLUDED.noleggi_giornalieri;
+
+    SELECT COALESCE(SUM(n.noleggi), 0)
+    INTO new_rentals
+    FROM new_hourly_counts n;
+
+    UPDATE bikemi_rentals.rentals_counts_watermark
+    SET last_id_caricamento = high_watermark
+    WHERE counts_table = 'station_counts';
+
+    RETURN new_rentals;
+END;
+$$;
@@ -0,0 +1,22 @@
+-- same rows as before_2019-materialized_view-bikemi_rentals.sql, with the year
+-- filter written as bounds: a rental returned before 2019 was picked up before
+-- 2019 too, and the bound on data_prelievo prunes the later partitions
+DROP MATERIALIZED VIEW IF EXISTS bikemi_rentals.bikemi_rentals_before_2019 CASCADE;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS bikemi_rentals.bikemi_rentals_before_2019 AS
+(
+SELECT b.bici,
+       b.tipo_bici,
+       b.cliente_anonimizzato,
+       date_trunc('second'::text, b.data_prelievo)     AS data_prelievo,
+       b.numero_stazione_prelievo,
+       b.nome_stazione_prelievo,
+       date_trunc('second'::text, b.data_restituzione) AS data_restituzione,
+       b.numero_stazione_restituzione,
+       b.nome_stazione_restituzione,
+       b.durata_noleggio
+FROM bikemi_source_data b
+WHERE b.data_prelievo < timestamp '2019-01-01'
+  AND b.data_restituzione < timestamp '2019-01-01'
+  AND b.durata_noleggio > '00:01:00'::interval
+    );
@@ -0,0 +1,33 @@
+-- replaces the materialized view of the same name: the zero-filled
+-- station x day grid is built on read from the incremental counts
+DROP MATERIALIZED VIEW IF EXISTS bikemi_rentals.daily_rentals_before_2019 CASCADE;
+
+CREATE OR REPLACE VIEW bikemi_rentals.daily_rentals_before_2019 AS
+(
+WITH cross_table AS (
+    SELECT d.date AS data_partenza,
+           s.nome AS stazione_partenza,
+           s.numero_stazione
+    FROM (
+             SELECT *
+             FROM bikemi_rentals.bikemi_stations
+             WHERE anno < 2019
+         ) s
+             CROSS JOIN (
+        SELECT generate_series(
+                       timestamp '2015-06-01',
+                       timestamp '2018-06-01',
+                       interval '1 day'
+                   )::date
+    ) d(date)
+)
+SELECT c.data_partenza,
+       c.stazione_partenza,
+       c.numero_stazione,
+       COALESCE(r.noleggi_giornalieri, 0)::smallint AS noleggi_giornalieri
+FROM cross_table c
+         LEFT JOIN bikemi_rentals.station_daily_counts r ON r.numero_stazione = c.numero_stazione
+    AND r.data_partenza = c.data_partenza
+ORDER BY stazione_partenza,
+         data_partenza
+    );
@@ -0,0 +1,37 @@
+-- replaces the materialized view of the same name: the zero-filled
+-- station x hour grid is built on read from the incremental counts
+DROP MATERIALIZED VIEW IF EXISTS bikemi_rentals.hourly_rentals_before_2019 CASCADE;
+
+CREATE OR REPLACE VIEW bikemi_rentals.hourly_rentals_before_2019 AS
+(
+WITH cross_table AS (
+    SELECT d.date_time AS data_partenza,
+           s.nome      AS stazione_partenza,
+           s.numero_stazione
+    FROM (
+             SELECT *
+             FROM bikemi_rentals.bikemi_stations
+             WHERE anno < 2019
+         ) s
+             CROSS JOIN (
+        SELECT generate_series(
+                       timestamp '2015-06-01',
+                       timestamp '2018-06-01',
+                       interval '1 hour'
+                   )::timestamp
+    ) d(date_time)
+    WHERE EXTRACT(
+                  'hour'
+                  FROM d.date_time
+              ) BETWEEN 7 and 24
+)
+SELECT c.data_partenza,
+       c.stazione_partenza,
+       c.numero_stazione,
+       COALESCE(r.noleggi_per_ora, 0)::smallint AS noleggi_per_ora
+FROM cross_table c
+         LEFT JOIN bikemi_rentals.station_hourly_counts r ON r.numero_stazione = c.numero_stazione
+    AND r.data_partenza = c.data_partenza
+ORDER BY stazione_partenza,
+         data_partenza
+    );
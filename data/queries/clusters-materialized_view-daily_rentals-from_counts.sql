@@ -0,0 +1,36 @@
+-- aggregates the sparse station x day counts by cluster (equality joins only)
+-- and zero-fills the much smaller cluster x day grid
+CREATE MATERIALIZED VIEW IF NOT EXISTS clusters_daily_rentals AS
+(
+WITH cluster_counts AS (
+    SELECT sdc.data_partenza,
+           bcs.cluster,
+           SUM(sdc.noleggi_giornalieri) AS noleggi_giornalieri
+    FROM bikemi_rentals.station_daily_counts sdc
+             JOIN bikemi_clustered_stalls bcs on sdc.numero_stazione = bcs.numero_stazione
+    GROUP BY sdc.data_partenza, bcs.cluster
+),
+     cross_table AS (
+         SELECT d.date AS data_partenza,
+                c.cluster,
+                c.cluster_nil
+         FROM (
+                  SELECT DISTINCT cluster, cluster_nil
+                  FROM bikemi_clustered_stalls
+              ) c
+                  CROSS JOIN (
+             SELECT generate_series(
+                            timestamp '2015-06-01',
+                            timestamp '2018-06-01',
+                            interval '1 day'
+                        )::date
+         ) d(date)
+     )
+SELECT c.data_partenza,
+       c.cluster_nil || ' - ' || c.cluster        AS cluster,
+       COALESCE(cc.noleggi_giornalieri, 0)::bigint AS noleggi_giornalieri
+FROM cross_table c
+         LEFT JOIN cluster_counts cc ON cc.cluster = c.cluster
+    AND cc.data_partenza = c.data_partenza
+ORDER BY c.cluster, c.data_partenza
+    );
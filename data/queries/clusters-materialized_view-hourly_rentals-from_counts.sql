@@ -0,0 +1,40 @@
+-- aggregates the sparse station x hour counts by cluster (equality joins only)
+-- and zero-fills the much smaller cluster x hour grid
+CREATE MATERIALIZED VIEW IF NOT EXISTS clusters_hourly_rentals AS
+(
+WITH cluster_counts AS (
+    SELECT shc.data_partenza,
+           bcs.cluster,
+           SUM(shc.noleggi_per_ora) AS noleggi_per_ora
+    FROM bikemi_rentals.station_hourly_counts shc
+             JOIN bikemi_clustered_stalls bcs on shc.numero_stazione = bcs.numero_stazione
+    GROUP BY shc.data_partenza, bcs.cluster
+),
+     cross_table AS (
+         SELECT d.date_time AS data_partenza,
+                c.cluster,
+                c.cluster_nil
+         FROM (
+                  SELECT DISTINCT cluster, cluster_nil
+                  FROM bikemi_clustered_stalls
+              ) c
+                  CROSS JOIN (
+             SELECT generate_series(
+                            timestamp '2015-06-01',
+                            timestamp '2018-06-01',
+                            interval '1 hour'
+                        )::timestamp
+         ) d(date_time)
+         WHERE EXTRACT(
+                       'hour'
+                       FROM d.date_time
+                   ) BETWEEN 7 and 24
+     )
+SELECT c.data_partenza,
+       c.cluster_nil || ' - ' || c.cluster    AS cluster,
+       COALESCE(cc.noleggi_per_ora, 0)::bigint AS noleggi_per_ora
+FROM cross_table c
+         LEFT JOIN cluster_counts cc ON cc.cluster = c.cluster
+    AND cc.data_partenza = c.data_partenza
+ORDER BY c.cluster, c.data_partenza
+    );
@@ -0,0 +1,8 @@
+-- the hour and day of pick-up, stored once so that aggregations can group
+-- and join on plain columns instead of DATE_TRUNC(data_prelievo)
+ALTER TABLE bikemi_source_data
+    ADD COLUMN IF NOT EXISTS ora_prelievo timestamp GENERATED ALWAYS AS (DATE_TRUNC('hour', data_prelievo)) STORED,
+    ADD COLUMN IF NOT EXISTS giorno_prelievo date GENERATED ALWAYS AS (data_prelievo::date) STORED;
+
+CREATE INDEX IF NOT EXISTS bikemi_source_data_stazione_ora_prelievo_idx
+    ON bikemi_source_data (numero_stazione_prelievo, ora_prelievo);
@@ -0,0 +1,17 @@
+-- bikemi_source_data as loaded by custom_functions/bulk_loader.py: durata_noleggio
+-- is computed before the load, so it is a plain column instead of the generated
+-- one of create_table-bikemi_rentals-compute_duration.sql
+CREATE TABLE IF NOT EXISTS bikemi_source_data
+(
+    bici                         text,
+    tipo_bici                    text,
+    cliente_anonimizzato         text,
+    data_prelievo                timestamp,
+    numero_stazione_prelievo     integer,
+    nome_stazione_prelievo       text,
+    data_restituzione            timestamp,
+    numero_stazione_restituzione integer,
+    nome_stazione_restituzione   text,
+    distanza_totale              double precision,
+    durata_noleggio              interval
+);
@@ -0,0 +1,38 @@
+-- the rentals partitioned by month of pick-up (see
+-- function-create_monthly_partitions.sql for the partitions themselves):
+-- queries bounded on data_prelievo only scan the months they need.
+-- id_caricamento numbers the rentals in order of loading, as in
+-- before_2019-create_table-rentals_counts.sql, from the same sequence
+CREATE SEQUENCE IF NOT EXISTS bikemi_source_data_id_caricamento_seq;
+
+CREATE TABLE IF NOT EXISTS bikemi_source_data_partitioned
+(
+    bici                         text,
+    tipo_bici                    text,
+    cliente_anonimizzato         text,
+    data_prelievo                timestamp NOT NULL,
+    numero_stazione_prelievo     integer,
+    nome_stazione_prelievo       text,
+    data_restituzione            timestamp,
+    numero_stazione_restituzione integer,
+    nome_stazione_restituzione   text,
+    distanza_totale              double precision,
+    durata_noleggio              interval,
+    id_caricamento               bigint    NOT NULL DEFAULT nextval('bikemi_source_data_id_caricamento_seq'),
+    ora_prelievo                 timestamp GENERATED ALWAYS AS (DATE_TRUNC('hour', data_prelievo)) STORED,
+    giorno_prelievo              date GENERATED ALWAYS AS (data_prelievo::date) STORED
+) PARTITION BY RANGE (data_prelievo);
+
+-- rentals outside the monthly partitions
+CREATE TABLE IF NOT EXISTS bikemi_source_data_default
+    PARTITION OF bikemi_source_data_partitioned DEFAULT;
+
+-- created on every partition
+CREATE INDEX IF NOT EXISTS bikemi_source_data_partitioned_data_prelievo_idx
+    ON bikemi_source_data_partitioned (data_prelievo);
+
+CREATE INDEX IF NOT EXISTS bikemi_source_data_partitioned_id_caricamento_idx
+    ON bikemi_source_data_partitioned (id_caricamento);
+
+CREATE INDEX IF NOT EXISTS bikemi_source_data_partitioned_stazione_ora_prelievo_idx
+    ON bikemi_source_data_partitioned (numero_stazione_prelievo, ora_prelievo);
@@ -0,0 +1,57 @@
+-- one row per transaction that wrote to a tracked table, added by a
+-- statement-level trigger in the same transaction: unlike the pg_stat
+-- counters, the number of rows of a table changes exactly when the writes
+-- commit. custom_functions/query_cache.py versions its cached results on it.
+-- One row per transaction (not a counter to increment) lets concurrent
+-- writers, e.g. the monthly rebuilds of the counts, commit without waiting
+-- for each other.
+CREATE TABLE IF NOT EXISTS bikemi_rentals.relation_writes
+(
+    relation       regclass NOT NULL,
+    transaction_id bigint   NOT NULL,
+    PRIMARY KEY (relation, transaction_id)
+);
+
+CREATE OR REPLACE FUNCTION bikemi_rentals.record_relation_write()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    INSERT INTO bikemi_rentals.relation_writes (relation, transaction_id)
+    VALUES (TG_RELID::regclass, txid_current())
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$;
+
+-- the tables read by the cached queries (materialized views are versioned
+-- by their file node, which REFRESH MATERIALIZED VIEW changes). Run again
+-- after migration-bikemi_source_data-partitioned.sql: the triggers stay on
+-- the heap
+DO
+$$
+    DECLARE
+        tracked regclass;
+    BEGIN
+        FOR tracked IN
+            SELECT TO_REGCLASS(t.name)
+            FROM UNNEST(ARRAY [
+                'bikemi_source_data',
+                'bikemi_clustered_stalls',
+                'bikemi_rentals.bikemi_stations',
+                'bikemi_rentals.station_daily_counts',
+                'bikemi_rentals.station_hourly_counts'
+                ]) t(name)
+            WHERE TO_REGCLASS(t.name) IS NOT NULL
+            LOOP
+                EXECUTE FORMAT('DROP TRIGGER IF EXISTS record_relation_write ON %s', tracked);
+                EXECUTE FORMAT(
+                        'CREATE TRIGGER record_relation_write '
+                            'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %s '
+                            'FOR EACH STATEMENT EXECUTE FUNCTION bikemi_rentals.record_relation_write()',
+                        tracked
+                    );
+            END LOOP;
+    END;
+$$;
@@ -0,0 +1,114 @@
+-- creates the monthly partitions of `parent` from `first_month` to
+-- `last_month` (included), named after the parent: <parent>_yYYYYmMM, in the
+-- schema of the parent. With `station_partitions` > 0, each month is further
+-- split by hash of the pick-up station into that many partitions. Existing
+-- months are skipped. The rentals of a new month already in the DEFAULT
+-- partition are moved into it.
+-- Usage: SELECT create_monthly_partitions('bikemi_source_data', '2015-06-01', '2018-12-01');
+CREATE OR REPLACE FUNCTION create_monthly_partitions(
+    parent regclass,
+    first_month date,
+    last_month date,
+    station_partitions integer DEFAULT 0
+)
+    RETURNS integer
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    parent_schema  text;
+    parent_name    text;
+    default_table  regclass;
+    stored_columns text;
+    month_start    timestamp;
+    month_end      timestamp;
+    month_table    text;
+    moved_rows     bigint;
+    created_months integer := 0;
+BEGIN
+    SELECT n.nspname, c.relname
+    INTO parent_schema, parent_name
+    FROM pg_class c
+             JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = parent;
+
+    SELECT NULLIF(p.partdefid, 0)::regclass
+    INTO default_table
+    FROM pg_partitioned_table p
+    WHERE p.partrelid = parent;
+
+    -- the columns that can be inserted, i.e. not generated
+    SELECT STRING_AGG(QUOTE_IDENT(a.attname), ', ' ORDER BY a.attnum)
+    INTO stored_columns
+    FROM pg_attribute a
+    WHERE a.attrelid = parent
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND a.attgenerated = '';
+
+    FOR month_start IN
+        SELECT generate_series(
+                       DATE_TRUNC('month', first_month::timestamp),
+                       DATE_TRUNC('month', last_month::timestamp),
+                       interval '1 month'
+                   )
+        LOOP
+            month_end := month_start + interval '1 month';
+            month_table := FORMAT('%s_y%sm%s', parent_name,
+                                  TO_CHAR(month_start, 'YYYY'), TO_CHAR(month_start, 'MM'));
+
+            CONTINUE WHEN TO_REGCLASS(FORMAT('%I.%I', parent_schema, month_table)) IS NOT NULL;
+
+            -- a partition cannot be attached while the DEFAULT partition
+            -- holds rows of its range: set them aside until it exists
+            moved_rows := 0;
+            IF default_table IS NOT NULL THEN
+                EXECUTE FORMAT(
+                        'CREATE TEMPORARY TABLE moved_rentals ON COMMIT DROP AS '
+                            'SELECT %s FROM %s WHERE data_prelievo >= %L AND data_prelievo < %L',
+                        stored_columns, default_table, month_start, month_end
+                    );
+                GET DIAGNOSTICS moved_rows = ROW_COUNT;
+
+                IF moved_rows > 0 THEN
+                    EXECUTE FORMAT(
+                            'DELETE FROM %s WHERE data_prelievo >= %L AND data_prelievo < %L',
+                            default_table, month_start, month_end
+                        );
+                END IF;
+            END IF;
+
+            EXECUTE FORMAT(
+                    'CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L) %s',
+                    parent_schema, month_table, parent, month_start, month_end,
+                    CASE
+                        WHEN station_partitions > 0 THEN 'PARTITION BY HASH (numero_stazione_prelievo)'
+                        ELSE ''
+                        END
+                );
+
+            FOR remainder IN 0..station_partitions - 1
+                LOOP
+                    EXECUTE FORMAT(
+                            'CREATE TABLE %I.%I PARTITION OF %I.%I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                            parent_schema, month_table || '_s' || remainder,
+                            parent_schema, month_table, station_partitions, remainder
+                        );
+                END LOOP;
+
+            IF default_table IS NOT NULL THEN
+                IF moved_rows > 0 THEN
+                    EXECUTE FORMAT(
+                            'INSERT INTO %s (%s) SELECT %s FROM moved_rentals',
+                            parent, stored_columns, stored_columns
+                        );
+                END IF;
+                DROP TABLE moved_rentals;
+            END IF;
+
+            created_months := created_months + 1;
+        END LOOP;
+
+    RETURN created_months;
+END;
+$$;
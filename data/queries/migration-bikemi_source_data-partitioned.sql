@@ -0,0 +1,47 @@
+-- swaps the names of bikemi_source_data and of the partitioned table, so the
+-- partitions are named after bikemi_source_data, then moves the rentals.
+-- Run after create_table-bikemi_source_data-partitioned.sql and
+-- function-create_monthly_partitions.sql. The views reading the old
+-- table follow it to bikemi_source_data_heap: recreate them afterwards
+-- (before_2019-materialized_view-bikemi_rentals-partitioned.sql), then
+-- drop the heap.
+BEGIN;
+
+ALTER TABLE bikemi_source_data
+    RENAME TO bikemi_source_data_heap;
+ALTER TABLE bikemi_source_data_partitioned
+    RENAME TO bikemi_source_data;
+
+-- the load order is kept, so the watermark of the counts stays valid; the
+-- sequence must outlive the heap
+ALTER SEQUENCE bikemi_source_data_id_caricamento_seq
+    OWNED BY bikemi_source_data.id_caricamento;
+
+SELECT create_monthly_partitions(
+               'bikemi_source_data',
+               (SELECT MIN(data_prelievo)::date FROM bikemi_source_data_heap),
+               (SELECT MAX(data_prelievo)::date FROM bikemi_source_data_heap)
+           );
+
+INSERT INTO bikemi_source_data
+(bici, tipo_bici, cliente_anonimizzato, data_prelievo, numero_stazione_prelievo, nome_stazione_prelievo,
+ data_restituzione, numero_stazione_restituzione, nome_stazione_restituzione, distanza_totale, durata_noleggio,
+ id_caricamento)
+SELECT bici,
+       tipo_bici,
+       cliente_anonimizzato,
+       data_prelievo,
+       numero_stazione_prelievo,
+       nome_stazione_prelievo,
+       data_restituzione,
+       numero_stazione_restituzione,
+       nome_stazione_restituzione,
+       distanza_totale,
+       durata_noleggio,
+       id_caricamento
+FROM bikemi_source_data_heap
+WHERE data_prelievo IS NOT NULL;
+
+COMMIT;
+
+ANALYZE bikemi_source_data;
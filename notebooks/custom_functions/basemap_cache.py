@@ -0,0 +1,230 @@
+import hashlib
+import os
+from pathlib import Path
+
+import contextily as cx
+import geopandas
+import matplotlib.pyplot as plt
+import numpy as np
+
+from custom_functions.layer_store import LayerStore, get_layer
+
+# for type stubs
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# where the basemaps are stored, unless `basemap_dir` is given
+BASEMAP_DIR = Path(
+    os.environ.get("BIKEMI_CACHE_DIR", Path.home() / ".cache" / "bikemi")
+) / "basemaps"
+
+# the basemap covers these layers, plus a margin (in metres)
+BASEMAP_LAYERS = ("nil", "stalls")
+BASEMAP_MARGIN = 1_000
+
+# enough detail for a city-wide map
+BASEMAP_ZOOM = 13
+
+# (x min, y min, x max, y max) in EPSG:3857
+Bounds = Tuple[float, float, float, float]
+
+# a layer to plot and the arguments of its .plot()
+Layer = Tuple[geopandas.GeoDataFrame, Dict[str, Any]]
+
+
+def basemap_bounds(
+    store: Optional[LayerStore] = None,
+    layers: Sequence[str] = BASEMAP_LAYERS,
+    margin: float = BASEMAP_MARGIN
+) -> Bounds:
+    """The bounds (EPSG:3857) of the layers of the store, plus a margin."""
+    load = get_layer if store is None else store.get
+    bounds = np.array([load(name, 3857).total_bounds for name in layers])
+    x_min, y_min = bounds[:, :2].min(axis=0) - margin
+    x_max, y_max = bounds[:, 2:].max(axis=0) + margin
+    return float(x_min), float(y_min), float(x_max), float(y_max)
+
+
+def basemap_path(
+    source: Any = None,
+    zoom: int = BASEMAP_ZOOM,
+    bounds: Optional[Bounds] = None,
+    basemap_dir: Optional[Path] = None
+) -> Path:
+    """The GeoTIFF of a tile source, zoom level and bounds."""
+    name = getattr(source, "name", None) or str(source or "default")
+    rounded = None if bounds is None else [round(value) for value in bounds]
+    key = hashlib.sha256(f"{name}{rounded}".encode()).hexdigest()[:8]
+    file_name = f"{name.replace('.', '_').replace('/', '_')[:40]}" \
+        f"-z{zoom}-{key}.tif"
+    return Path(basemap_dir or BASEMAP_DIR) / file_name
+
+
+def download_basemap(
+    source: Any = None,
+    zoom: int = BASEMAP_ZOOM,
+    bounds: Optional[Bounds] = None,
+    basemap_dir: Optional[Path] = None
+) -> Path:
+    """
+    Downloads the tiles covering `bounds` (by default `basemap_bounds()`)
+    once, and stores them as a GeoTIFF in EPSG:3857; later calls only
+    return its path.
+    """
+    bounds = basemap_bounds() if bounds is None else bounds
+    path = basemap_path(source, zoom, bounds, basemap_dir)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp.tif")
+        cx.bounds2raster(
+            *bounds, str(temporary), zoom=zoom, source=source, ll=False
+        )
+        os.replace(temporary, path)
+    return path
+
+
+def add_basemap(
+    ax: plt.Axes,
+    source: Any = None,
+    zoom: int = BASEMAP_ZOOM,
+    bounds: Optional[Bounds] = None,
+    basemap_dir: Optional[Path] = None,
+    offline: bool = False,
+    **kwargs: Any
+) -> None:
+    """
+    `cx.add_basemap()` from the stored GeoTIFF, downloaded on first use
+    (see `download_basemap()`); the axes must be in EPSG:3857.
+
+    Args:
+    ax (plt.Axes): the axes.
+
+    source, zoom, bounds: see `download_basemap()`.
+
+    offline (bool, optional): raise FileNotFoundError instead of
+    downloading a missing basemap.
+
+    **kwargs: passed on to `cx.add_basemap()`.
+    """
+    bounds = basemap_bounds() if bounds is None else bounds
+    path = basemap_path(source, zoom, bounds, basemap_dir)
+    if not path.exists():
+        if offline:
+            raise FileNotFoundError(
+                f"no basemap at {path}: run download_basemap() once online"
+            )
+        download_basemap(source, zoom, bounds, basemap_dir)
+    cx.add_basemap(ax, source=str(path), **kwargs)
+
+
+class StaticBackground:
+    """
+    The basemap and the layers that do not change between maps, drawn once
+    into an image: each map then shows the image and plots its own layers
+    on top, instead of reading the basemap and plotting every layer again.
+
+    Example:
+    background = StaticBackground([
+        (store.get("nil", 3857), {"alpha": 0.2}),
+    ])
+    for k, clusters in results.items():
+        fig, ax = background.subplots()
+        clusters.to_crs(3857).plot(column="cluster", ax=ax)
+    """
+
+    def __init__(
+        self,
+        layers: Sequence[Layer] = (),
+        extent: Optional[Bounds] = None,
+        figsize: Tuple[float, float] = (10, 10),
+        dpi: Optional[float] = None,
+        source: Any = None,
+        zoom: int = BASEMAP_ZOOM,
+        basemap_dir: Optional[Path] = None,
+        offline: bool = False
+    ):
+        self.extent = basemap_bounds() if extent is None else extent
+        x_min, y_min, x_max, y_max = self.extent
+        # the axes fill the figure, with the aspect of the extent
+        self.figsize = (
+            figsize[0], figsize[0] * (y_max - y_min) / (x_max - x_min)
+        )
+        # the resolution of the maps, so the image is barely resampled
+        self.dpi = dpi or plt.rcParams["figure.dpi"]
+
+        fig = plt.figure(figsize=self.figsize, dpi=self.dpi)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis("off")
+        for layer, plot_kwargs in layers:
+            layer.to_crs(3857).plot(ax=ax, **plot_kwargs)
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_min, y_max)
+        add_basemap(
+            ax, source, zoom, basemap_dir=basemap_dir, offline=offline,
+            reset_extent=False
+        )
+
+        fig.canvas.draw()
+        self.image = np.array(fig.canvas.buffer_rgba())[:, :, :3]
+        plt.close(fig)
+
+    def draw(self, ax: plt.Axes) -> None:
+        """Shows the background on `ax`, with its extent, axis off."""
+        x_min, y_min, x_max, y_max = self.extent
+        ax.imshow(
+            self.image, extent=(x_min, x_max, y_min, y_max), zorder=0,
+            interpolation="antialiased"
+        )
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_min, y_max)
+        ax.axis("off")
+
+    def subplots(
+        self,
+        figsize: Optional[Tuple[float, float]] = None
+    ) -> Tuple[plt.Figure, plt.Axes]:
+        """A new figure with the background already drawn."""
+        fig, ax = plt.subplots(1, 1, figsize=figsize or self.figsize)
+        self.draw(ax)
+        return fig, ax
+
+    def render(
+        self,
+        layers: Sequence[Layer],
+        title: Optional[str] = None,
+        path: Optional[Union[str, Path]] = None,
+        **title_kwargs: Any
+    ) -> Optional[plt.Figure]:
+        """
+        A map of `layers` over the background; saved to `path` (and
+        closed) if given, else returned.
+        """
+        fig, ax = self.subplots()
+        for layer, plot_kwargs in layers:
+            layer.to_crs(3857).plot(ax=ax, **plot_kwargs)
+        if title is not None:
+            ax.set_title(title, **title_kwargs)
+        if path is None:
+            return fig
+        fig.savefig(path, bbox_inches="tight")
+        plt.close(fig)
+        return None
+
+
+def render_maps(
+    maps: Dict[str, List[Layer]],
+    directory: Union[str, Path],
+    background: StaticBackground,
+    file_format: str = "png"
+) -> List[Path]:
+    """
+    Saves one map per entry of `maps` (file name -> dynamic layers) over
+    the same background, e.g. the clusters for each k.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, layers in maps.items():
+        path = directory / f"{name}.{file_format}"
+        background.render(layers, path=path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,549 @@
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# for type stubs
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, \
+    Sequence, Tuple
+
+from custom_functions.calendar_features import calendar_features
+from custom_functions.rentals_stream import (
+    RENTALS_QUERY,
+    aggregate_rentals,
+    iter_rentals,
+    read_rentals
+)
+
+# the other benchmarks import their (optional) dependencies when they run,
+# e.g. the calendar one needs neither GeoPandas, nor psycopg2 nor sklearn
+if TYPE_CHECKING:
+    import geopandas
+
+QUERIES_PATH = Path(__file__).resolve().parents[2] / "data" / "queries"
+
+# the station x hour grid of the synthetic rentals, as the hourly view builds
+_HOURLY_CROSS_TABLE = """
+    WITH cross_table AS (
+        SELECT d.date_time AS data_partenza,
+               s.nome      AS stazione_partenza,
+               s.numero_stazione
+        FROM bikemi_benchmark.bikemi_stations s
+                 CROSS JOIN (
+            SELECT generate_series(
+                           timestamp '2015-06-01',
+                           timestamp '2018-06-01',
+                           interval '1 hour'
+                       )::timestamp
+        ) d(date_time)
+        WHERE EXTRACT('hour' FROM d.date_time) BETWEEN 7 and 24
+    )
+"""
+
+HOURLY_RENTALS_QUERIES: Dict[str, str] = {
+    # the original join, on an expression of every rental
+    "date_trunc join": _HOURLY_CROSS_TABLE + """
+        SELECT c.data_partenza,
+               c.numero_stazione,
+               COUNT(b.*)::smallint AS noleggi_per_ora
+        FROM cross_table c
+                 LEFT JOIN bikemi_benchmark.bikemi_rentals b
+                           ON b.numero_stazione_prelievo = c.numero_stazione
+                               AND DATE_TRUNC('hour', b.data_prelievo)::timestamp
+                                   = c.data_partenza
+        GROUP BY c.data_partenza, c.numero_stazione
+    """,
+    # rentals grouped on the stored bucket first, then an equality join
+    "stored bucket": _HOURLY_CROSS_TABLE + """
+        SELECT c.data_partenza,
+               c.numero_stazione,
+               COALESCE(b.noleggi, 0)::smallint AS noleggi_per_ora
+        FROM cross_table c
+                 LEFT JOIN (
+            SELECT numero_stazione_prelievo, ora_prelievo, COUNT(*) AS noleggi
+            FROM bikemi_benchmark.bikemi_rentals
+            GROUP BY numero_stazione_prelievo, ora_prelievo
+        ) b ON b.numero_stazione_prelievo = c.numero_stazione
+            AND b.ora_prelievo = c.data_partenza
+    """,
+    # the incremental counts table: only the zero-filling is left
+    "pre-aggregated counts": _HOURLY_CROSS_TABLE + """
+        SELECT c.data_partenza,
+               c.numero_stazione,
+               COALESCE(r.noleggi_per_ora, 0)::smallint AS noleggi_per_ora
+        FROM cross_table c
+                 LEFT JOIN bikemi_benchmark.station_hourly_counts r
+                           ON r.numero_stazione = c.numero_stazione
+                               AND r.data_partenza = c.data_partenza
+    """,
+}
+
+
+def time_it(function: Callable[[], object], repeat: int = 3) -> float:
+    """Returns the best wall time (in seconds) out of `repeat` runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _speedup(timings: pd.DataFrame, column: str = "seconds") -> pd.DataFrame:
+    # how many times faster than the first implementation (the baseline)
+    return timings.assign(speedup=lambda x: x[column].iloc[0] / x[column])
+
+
+def _compare(
+    implementations: Dict[str, Callable[[], object]],
+    repeat: int = 1
+) -> pd.DataFrame:
+    """
+    Times each of `implementations` (the best out of `repeat` runs) and
+    returns the seconds and the speedup over the first one, by name.
+    """
+    timings = pd.DataFrame(
+        {
+            "seconds": [
+                time_it(function, repeat)
+                for function in implementations.values()
+            ]
+        },
+        index=pd.Index(list(implementations), name="implementation")
+    )
+    return _speedup(timings)
+
+
+def _pandas_calendar_features(index: pd.DatetimeIndex) -> pd.DataFrame:
+    # the original column-by-column implementation of `create_ts_features`
+    dataframe = pd.DataFrame(index=index)
+    dataframe["hour"] = index.hour.astype("category")
+    dataframe["day"] = index.day.astype("category")
+    dataframe["is_weekend"] = index.isocalendar().day \
+        .apply(lambda x: 1 if x in [6, 7] else 0).astype("category")
+    dataframe["week"] = index.isocalendar().week.astype("category")
+    dataframe["month"] = index.month.astype("category")
+    dataframe["year"] = index.year.astype("category")
+    return dataframe
+
+
+def benchmark_calendar_features(
+    n_rows: int = 10_000_000,
+    repeat: int = 3
+) -> pd.DataFrame:
+    """
+    Compares `calendar_features` with the pandas accessors
+    on an hourly index of `n_rows` timestamps.
+    """
+    index = pd.date_range("2015-06-01", periods=n_rows, freq="h")
+    features: List[str] = ["hour", "day", "weekends", "week", "month", "year"]
+
+    implementations: Dict[str, Callable[[], object]] = {
+        "pandas accessors": lambda: _pandas_calendar_features(index),
+        "calendar_features": lambda: calendar_features(index, features),
+    }
+
+    return _compare(implementations, repeat) \
+        .assign(rows_per_second=lambda x: n_rows / x.seconds)
+
+
+def benchmark_stationarity_tests(
+    n_series: int = 200,
+    n_obs: int = 1_096,
+    n_jobs: Optional[int] = None,
+    seed: int = 42
+) -> pd.DataFrame:
+    """
+    Compares serial and parallel `stationarity_tests` (ADF and KPSS)
+    on `n_series` synthetic daily series, half of them random walks.
+    """
+    from custom_functions.time_series_functions import stationarity_tests
+
+    rng = np.random.default_rng(seed)
+    shocks = rng.normal(size=(n_obs, n_series))
+    shocks[:, ::2] = shocks[:, ::2].cumsum(axis=0)
+    data = pd.DataFrame(
+        shocks,
+        index=pd.date_range("2015-06-01", periods=n_obs, freq="D"),
+        columns=[f"series_{i}" for i in range(n_series)]
+    )
+
+    implementations: Dict[str, Callable[[], object]] = {
+        "serial": lambda: stationarity_tests(data, n_jobs=1),
+        "parallel": lambda: stationarity_tests(data, n_jobs=n_jobs),
+    }
+
+    return _compare(implementations)
+
+
+def benchmark_kmeans_sweep(
+    data: pd.DataFrame,
+    k_max: int = 150,
+    random_state: int = 42,
+    n_jobs: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Compares the sequential k-means sweep of chapter 04 (`n_jobs=1`) with
+    the parallel sweep, with and without warm starts, on e.g. the longitude
+    and latitude of the stalls.
+    """
+    from custom_functions.clustering import get_kmeans_metrics
+
+    implementations: Dict[str, Callable[[], object]] = {
+        "sequential": lambda: get_kmeans_metrics(
+            data, k_max, random_state, n_jobs=1
+        ),
+        "parallel": lambda: get_kmeans_metrics(
+            data, k_max, random_state, n_jobs=n_jobs
+        ),
+        "parallel, warm start": lambda: get_kmeans_metrics(
+            data, k_max, random_state, n_jobs=n_jobs, warm_start=True
+        ),
+    }
+
+    return _compare(implementations)
+
+
+def benchmark_silhouette(
+    n_points: int = 10_000,
+    n_clusters: int = 20,
+    sample_sizes: Sequence[int] = (500, 2_000),
+    seed: int = 42
+) -> pd.DataFrame:
+    """
+    Compares the exact silhouette with the sampled and the centroid ones,
+    in time and accuracy, on `n_points` points (Gaussian blobs around
+    random centres) clustered by k-means.
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+
+    from custom_functions.clustering import (
+        centroid_silhouette,
+        sampled_silhouette
+    )
+
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(-10, 10, size=(n_clusters, 2))
+    data = centres[rng.integers(n_clusters, size=n_points)] \
+        + rng.normal(size=(n_points, 2))
+    kmeans = KMeans(n_clusters, random_state=seed).fit(data)
+    labels = kmeans.labels_
+
+    implementations: Dict[str, Callable[[], Tuple[float, float]]] = {
+        "exact": lambda: (silhouette_score(data, labels), 0.0),
+        **{
+            f"sampled ({size})": (
+                lambda size=size: sampled_silhouette(data, labels, size, seed)
+            )
+            for size in sample_sizes
+        },
+        "centroid": lambda: (
+            centroid_silhouette(data, labels, kmeans.cluster_centers_), np.nan
+        ),
+    }
+
+    timings = _compare(implementations)
+    timings["silhouette"], timings["std_error"] = \
+        zip(*(function() for function in implementations.values()))
+
+    return timings.assign(
+        absolute_error=lambda x: (x.silhouette - x.silhouette.iloc[0]).abs()
+    )
+
+
+def _join_node(plan: Dict[str, Any]) -> Optional[str]:
+    # the first join of the plan tree (depth first), e.g. "Hash Join"
+    if plan["Node Type"].endswith(("Join", "Nested Loop")):
+        return plan["Node Type"]
+    for child in plan.get("Plans", []):
+        node = _join_node(child)
+        if node is not None:
+            return node
+    return None
+
+
+def explain_analyze(connection: Any, query: str) -> Dict[str, Any]:
+    """Runs `query` with EXPLAIN ANALYZE and returns the JSON plan."""
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query)
+        plan = cursor.fetchone()[0]
+    connection.rollback()
+    # psycopg2 parses json columns, but not every driver does
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]
+
+
+def benchmark_rentals_aggregation(
+    connection: Any,
+    generate_data: bool = True
+) -> pd.DataFrame:
+    """
+    Compares, with EXPLAIN ANALYZE, the hourly rentals aggregation joining
+    on DATE_TRUNC(data_prelievo) with the one joining on the stored hour of
+    pick-up and with the zero-filling of the pre-aggregated counts.
+
+    The queries run on the synthetic rentals created by
+    "benchmark-create_table-generated_rentals.sql" in the schema
+    "bikemi_benchmark" (built first if `generate_data` is True).
+
+    Args:
+    connection: a psycopg2 connection to a local database.
+
+    generate_data (bool, optional): (re)create the synthetic dataset.
+    """
+    if generate_data:
+        script = (
+            QUERIES_PATH / "benchmark-create_table-generated_rentals.sql"
+        ).read_text()
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute(script)
+
+    plans = {
+        name: explain_analyze(connection, query)
+        for name, query in HOURLY_RENTALS_QUERIES.items()
+    }
+
+    timings = pd.DataFrame(
+        {
+            "planning_ms": [plan["Planning Time"] for plan in plans.values()],
+            "execution_ms": [
+                plan["Execution Time"] for plan in plans.values()
+            ],
+            "join": [_join_node(plan["Plan"]) for plan in plans.values()],
+        },
+        index=pd.Index(list(plans), name="implementation")
+    )
+
+    return _speedup(timings, "execution_ms")
+
+
+def _load_rentals(task: Tuple[str, str, str]) -> Tuple[float, float, int]:
+    # runs in a fresh process: the peak RSS is then the one of the load only
+    import psutil
+    import psycopg2
+
+    implementation, dsn, query = task
+    baseline = psutil.Process().memory_info().rss
+
+    start = time.perf_counter()
+    connection = psycopg2.connect(dsn)
+    try:
+        if implementation == "pd.read_sql":
+            rows = len(pd.read_sql(query, connection))
+        elif implementation == "read_rentals":
+            rows = len(read_rentals(connection, query))
+        else:
+            rows = len(aggregate_rentals(
+                iter_rentals(connection, query),
+                by=["numero_stazione_prelievo"], freq="D"
+            ))
+    finally:
+        connection.close()
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in bytes on macOS, in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak *= 1 if sys.platform == "darwin" else 1_024
+
+    return seconds, (peak - baseline) / 2 ** 20, rows
+
+
+def benchmark_rentals_loading(
+    dsn: str,
+    query: str = RENTALS_QUERY
+) -> pd.DataFrame:
+    """
+    Compares time and peak memory (RSS above the interpreter's baseline,
+    in MiB) of `pd.read_sql`, of the streamed `read_rentals` and of the
+    out-of-core daily counts by station of `aggregate_rentals`.
+    Each implementation runs in a new process.
+    """
+    implementations = ["pd.read_sql", "read_rentals", "aggregate_rentals"]
+
+    results = []
+    for implementation in implementations:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results.append(
+                executor.submit(_load_rentals, (implementation, dsn, query))
+                .result()
+            )
+
+    return pd.DataFrame(
+        results,
+        index=pd.Index(implementations, name="implementation"),
+        columns=["seconds", "peak_rss_mib", "rows"]
+    )
+
+
+def _synthetic_export(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    # rentals shaped like the yearly exports, with their headers
+    rng = np.random.default_rng(seed)
+    pick_up = pd.Timestamp("2016-01-01") \
+        + pd.to_timedelta(rng.integers(0, 365 * 86_400, n_rows), unit="s")
+    stations = np.array([f"Stazione {i}" for i in range(300)])
+    origin = rng.integers(0, 300, n_rows)
+    destination = rng.integers(0, 300, n_rows)
+    return pd.DataFrame({
+        "Bici": rng.integers(1, 5_000, n_rows),
+        "Tipo Bici": rng.choice(["Bici", "Ebike"], n_rows),
+        "Cliente Anonimizzato": rng.integers(1, 100_000, n_rows),
+        "Data Prelievo": pick_up,
+        "Numero Stazione Prelievo": origin,
+        "Nome Stazione Prelievo": stations[origin],
+        "Data Restituzione": pick_up
+        + pd.to_timedelta(rng.integers(30, 3_600, n_rows), unit="s"),
+        "Numero Stazione Restituzione": destination,
+        "Nome Stazione Restituzione": stations[destination],
+        "Distanza Totale": rng.uniform(0, 10, n_rows).round(2),
+    })
+
+
+def benchmark_bulk_load(
+    n_rows: int = 1_000_000,
+    dsn: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Seconds per million rows of each step of `load_rentals` on a synthetic
+    CSV export: reading, typing and filtering, binary encoding and - if a
+    `dsn` is given - the whole load into a temporary copy of the table.
+    """
+    from custom_functions.bulk_loader import (
+        encode_copy_rows,
+        load_rentals,
+        prepare_rentals,
+        read_export
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "rentals_2016.csv"
+        _synthetic_export(n_rows).to_csv(path, index=False)
+
+        data = read_export(path)
+        rentals = prepare_rentals(data)
+        implementations: Dict[str, Callable[[], object]] = {
+            "read_export": lambda: read_export(path),
+            "prepare_rentals": lambda: prepare_rentals(data),
+            "encode_copy_rows": lambda: encode_copy_rows(rentals),
+        }
+        timings = {
+            name: time_it(function, repeat=1)
+            for name, function in implementations.items()
+        }
+
+        if dsn is not None:
+            import psycopg2
+
+            connection = psycopg2.connect(dsn)
+            try:
+                with connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "CREATE TEMPORARY TABLE bulk_load_benchmark "
+                            "(LIKE bikemi_source_data INCLUDING DEFAULTS)"
+                        )
+                start = time.perf_counter()
+                load_rentals([path], connection, table="bulk_load_benchmark")
+                timings["load_rentals"] = time.perf_counter() - start
+            finally:
+                connection.close()
+
+    return pd.DataFrame(
+        {"seconds": list(timings.values())},
+        index=pd.Index(list(timings), name="step")
+    ).assign(
+        seconds_per_million_rows=lambda x: x.seconds / n_rows * 1e6,
+        rows_per_second=lambda x: n_rows / x.seconds
+    )
+
+
+def _geopandas_facility_features(
+    points: "geopandas.GeoSeries",
+    facilities: Dict[str, "geopandas.GeoSeries"],
+    radii: Sequence[float]
+) -> pd.DataFrame:
+    # a distance() call per point and facility, as with plain GeoPandas
+    rows = []
+    for point in points:
+        row = {}
+        for name, geometry in facilities.items():
+            distances = geometry.distance(point)
+            row[f"dist_{name}"] = distances.min()
+            for radius in radii:
+                row[f"n_{name}_{radius:g}m"] = (distances <= radius).sum()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def benchmark_facility_features(
+    n_points: int = 1_000,
+    radii: Optional[Sequence[float]] = None,
+    seed: int = 42
+) -> pd.DataFrame:
+    """
+    Compares `FacilityIndex.features()` with a loop of GeoPandas
+    `distance()` calls on `n_points` random points within the bounds of
+    the stalls, in time and in the error of the distance to the nearest
+    bike lane (exact in the loop, on points along the lanes in the index).
+    The `radii` default to the ones of `facility_features.RADII`.
+    """
+    import geopandas
+
+    from custom_functions.facility_features import (
+        FACILITY_LAYERS,
+        METRIC_CRS,
+        RADII,
+        FacilityIndex
+    )
+    from custom_functions.layer_store import get_layer
+
+    if radii is None:
+        radii = RADII
+
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = get_layer("stalls").total_bounds
+    lon = rng.uniform(min_lon, max_lon, n_points)
+    lat = rng.uniform(min_lat, max_lat, n_points)
+
+    facilities = {
+        name: get_layer(layer).geometry.to_crs(METRIC_CRS)
+        for name, layer in FACILITY_LAYERS.items()
+    }
+    points = geopandas.GeoSeries(
+        geopandas.points_from_xy(lon, lat, crs=4326)
+    ).to_crs(METRIC_CRS)
+
+    start = time.perf_counter()
+    index = FacilityIndex(
+        {name: geometry.to_frame() for name, geometry in facilities.items()}
+    )
+    build_seconds = time.perf_counter() - start
+
+    implementations: Dict[str, Callable[[], pd.DataFrame]] = {
+        "geopandas distance loop": lambda: _geopandas_facility_features(
+            points, facilities, radii
+        ),
+        "FacilityIndex": lambda: index.features(lon, lat, radii=radii),
+    }
+
+    timings = _compare(implementations)
+    results = [function() for function in implementations.values()]
+    exact = results[0]["dist_bike_lane"]
+
+    return timings.assign(
+        build_seconds=[0.0, build_seconds],
+        max_lane_error=[
+            (result["dist_bike_lane"] - exact).abs().max()
+            for result in results
+        ],
+        points_per_second=lambda x: n_points / x.seconds
+    )
@@ -0,0 +1,402 @@
+import io
+import itertools
+import os
+import re
+import time
+import unicodedata
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# for type stubs
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# the columns of bikemi_source_data, in order, with their Postgres types
+# (see data/queries/create_table-bikemi_source_data-bulk_load.sql)
+RENTALS_SCHEMA: Dict[str, str] = {
+    "bici": "text",
+    "tipo_bici": "text",
+    "cliente_anonimizzato": "text",
+    "data_prelievo": "timestamp",
+    "numero_stazione_prelievo": "integer",
+    "nome_stazione_prelievo": "text",
+    "data_restituzione": "timestamp",
+    "numero_stazione_restituzione": "integer",
+    "nome_stazione_restituzione": "text",
+    "distanza_totale": "double precision",
+    "durata_noleggio": "interval",
+}
+
+# trips this short are not trips (as in bikemi_rentals_before_2019)
+MIN_DURATION = pd.Timedelta(minutes=1)
+
+# from pandas 2, to_datetime() infers the format from the first value and
+# coerces the values in any other format to NaT, unless told they are mixed
+_INFERS_ONE_FORMAT = \
+    tuple(int(part) for part in pd.__version__.split(".")[:2]) >= (2, 0)
+
+# rows encoded at once, to bound the memory of the index arrays
+COPY_CHUNK_ROWS = 200_000
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") * 2
+PGCOPY_TRAILER = (-1).to_bytes(2, "big", signed=True)
+
+# Postgres timestamps count microseconds from 2000-01-01
+POSTGRES_EPOCH_US = 946_684_800_000_000
+DAY_US = 86_400_000_000
+
+
+def normalize_header(name: str) -> str:
+    """
+    Column names as in the database: "Data Prelievo" and "data_prelievo "
+    both become "data_prelievo"; accents are dropped.
+    """
+    ascii_name = unicodedata.normalize("NFKD", str(name)) \
+        .encode("ascii", "ignore").decode()
+    return re.sub(r"[^0-9a-z]+", "_", ascii_name.lower()).strip("_")
+
+
+def read_export(
+    path: Union[str, Path],
+    aliases: Optional[Dict[str, str]] = None
+) -> pd.DataFrame:
+    """
+    Reads a yearly export (.xlsx or .csv) with normalised headers,
+    keeping only the columns of `RENTALS_SCHEMA`.
+
+    Args:
+    path (str or Path): the file.
+
+    aliases (dict, optional): normalised header -> column name, for the
+    exports whose headers differ from the column names.
+    """
+    aliases = aliases or {}
+
+    def column_name(header: str) -> str:
+        normalized = normalize_header(header)
+        return aliases.get(normalized, normalized)
+
+    def wanted(header: str) -> bool:
+        return column_name(header) in RENTALS_SCHEMA
+
+    path = Path(path)
+    if path.suffix.lower() in (".xlsx", ".xls"):
+        data = pd.read_excel(path, usecols=wanted, dtype=object)
+    else:
+        data = pd.read_csv(path, usecols=wanted, dtype=str)
+
+    return data.rename(columns=column_name)
+
+
+def prepare_rentals(
+    data: pd.DataFrame,
+    min_duration: Optional[pd.Timedelta] = MIN_DURATION,
+    dayfirst: bool = False,
+    date_format: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Types the columns, computes `durata_noleggio` (truncated to the
+    second, like the generated column it replaces) and drops invalid rows:
+    no pick-up or return time or station, and trips not longer than
+    `min_duration` (None keeps them all).
+
+    Dates are parsed with `date_format` (e.g. "%d/%m/%Y %H:%M:%S") if
+    given, otherwise each value is parsed on its own, whatever its format.
+    The dates that cannot be parsed are counted, by column, in
+    `attrs["unparsed_dates"]`, with a warning: their rows are dropped.
+    """
+    output = pd.DataFrame(index=data.index)
+    unparsed_dates = {}
+    for col, pg_type in RENTALS_SCHEMA.items():
+        if col == "durata_noleggio":
+            continue
+        values = data[col] if col in data else pd.Series(None, data.index)
+        if pg_type == "timestamp":
+            date_kwargs = {"format": date_format} if date_format \
+                else {"format": "mixed"} if _INFERS_ONE_FORMAT else {}
+            output[col] = pd.to_datetime(
+                values, errors="coerce", dayfirst=dayfirst, **date_kwargs
+            ).astype("datetime64[ns]")
+            unparsed_dates[col] = int(
+                (values.notna() & output[col].isna()).sum()
+            )
+        elif pg_type == "integer":
+            output[col] = pd.to_numeric(values, errors="coerce") \
+                .astype("Int32")
+        elif pg_type == "double precision":
+            output[col] = pd.to_numeric(values, errors="coerce") \
+                .astype(float)
+        else:
+            output[col] = values.astype(object).where(values.notna(), None)
+
+    if any(unparsed_dates.values()):
+        warnings.warn(
+            f"Dates that could not be parsed (rows dropped): {unparsed_dates}"
+        )
+
+    output["durata_noleggio"] = (
+        output["data_restituzione"] - output["data_prelievo"]
+    ).dt.floor("s")
+
+    valid = output[[
+        "data_prelievo", "data_restituzione",
+        "numero_stazione_prelievo", "numero_stazione_restituzione"
+    ]].notna().all(axis=1)
+    if min_duration is not None:
+        valid &= output["durata_noleggio"] > min_duration
+
+    output = output[valid].reset_index(drop=True)
+    output.attrs["unparsed_dates"] = unparsed_dates
+    return output
+
+
+def _encode_fixed(
+    values: np.ndarray,
+    is_null: np.ndarray,
+    dtype: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    width = np.dtype(dtype).itemsize
+    sizes = np.where(is_null, -1, width).astype(np.int64)
+    payload = np.ascontiguousarray(values.astype(dtype)) \
+        .view(np.uint8).reshape(len(values), width)
+    return sizes, payload
+
+
+def _encode_column(
+    values: pd.Series,
+    pg_type: str
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    The binary COPY encoding of a column: the size of each value (-1 for
+    NULL) and the bytes, either a (rows x width) array for fixed-width
+    types or, for text, the bytes of all the rows one after the other
+    (plus where each row starts).
+    """
+    is_null = values.isna().to_numpy()
+
+    if pg_type == "text":
+        # encode each distinct string once, then gather
+        codes, uniques = pd.factorize(values.astype(object))
+        encoded = [str(value).encode() for value in uniques]
+        lengths = np.array([len(value) for value in encoded] + [0], np.int64)
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        starts = np.concatenate([[0], np.cumsum(lengths[:-1])])
+        sizes = np.where(codes < 0, -1, lengths[codes])
+        return sizes, blob, starts[codes]
+
+    if pg_type == "integer":
+        return (*_encode_fixed(
+            values.fillna(0).to_numpy(dtype=np.int64), is_null, ">i4"
+        ), None)
+
+    if pg_type == "double precision":
+        return (*_encode_fixed(
+            values.fillna(0).to_numpy(dtype=float), is_null, ">f8"
+        ), None)
+
+    # timestamps and intervals as microseconds
+    nanoseconds = values.to_numpy().astype("int64", copy=False)
+    microseconds = np.where(is_null, 0, nanoseconds // 1_000)
+    if pg_type == "timestamp":
+        return (*_encode_fixed(
+            microseconds - POSTGRES_EPOCH_US, is_null, ">i8"
+        ), None)
+
+    # interval: time of the day, days, months
+    days, time_of_day = np.divmod(microseconds, DAY_US)
+    sizes = np.where(is_null, -1, 16).astype(np.int64)
+    payload = np.concatenate([
+        time_of_day.astype(">i8").view(np.uint8).reshape(-1, 8),
+        days.astype(">i4").view(np.uint8).reshape(-1, 4),
+        np.zeros((len(days), 4), dtype=np.uint8),
+    ], axis=1)
+    return sizes, payload, None
+
+
+def encode_copy_rows(data: pd.DataFrame) -> bytes:
+    """
+    The rows of `data` in Postgres' binary COPY format (without the header
+    and the trailer), built column by column with numpy.
+    """
+    n_rows = len(data)
+    if not n_rows:
+        return b""
+
+    columns = [
+        _encode_column(data[col], pg_type)
+        for col, pg_type in RENTALS_SCHEMA.items()
+    ]
+
+    row_sizes = 2 + sum(4 + np.maximum(sizes, 0) for sizes, _, _ in columns)
+    row_starts = np.concatenate([[0], np.cumsum(row_sizes)[:-1]]) \
+        .astype(np.int64)
+    buffer = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    # the number of fields of each row
+    field_count = np.array([len(columns)], dtype=">i2").view(np.uint8)
+    buffer[row_starts[:, None] + np.arange(2)] = field_count
+
+    cursor = row_starts + 2
+    for sizes, payload, starts in columns:
+        buffer[cursor[:, None] + np.arange(4)] = \
+            sizes.astype(">i4").view(np.uint8).reshape(n_rows, 4)
+        cursor = cursor + 4
+        lengths = np.maximum(sizes, 0)
+
+        if starts is None:
+            # fixed width: write the non-null rows
+            valid = sizes >= 0
+            width = payload.shape[1]
+            buffer[cursor[valid, None] + np.arange(width)] = payload[valid]
+        elif lengths.sum():
+            # variable width: scatter each row's bytes after its size
+            offsets = np.arange(lengths.sum()) \
+                - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            buffer[np.repeat(cursor, lengths) + offsets] = \
+                payload[np.repeat(starts, lengths) + offsets]
+
+        cursor = cursor + lengths
+
+    return buffer.tobytes()
+
+
+def _load_export(
+    task: Tuple[Path, Optional[Dict[str, str]], Optional[pd.Timedelta], bool,
+                Optional[str]]
+) -> Tuple[Path, int, int, int, float, List[bytes]]:
+    # runs in a worker: read, prepare and encode one export
+    path, aliases, min_duration, dayfirst, date_format = task
+    start = time.perf_counter()
+    data = read_export(path, aliases)
+    rentals = prepare_rentals(data, min_duration, dayfirst, date_format)
+    blocks = [
+        encode_copy_rows(rentals.iloc[first:first + COPY_CHUNK_ROWS])
+        for first in range(0, len(rentals), COPY_CHUNK_ROWS)
+    ]
+    unparsed = sum(rentals.attrs["unparsed_dates"].values())
+    return (path, len(data), len(rentals), unparsed,
+            time.perf_counter() - start, blocks)
+
+
+class _BlocksReader(io.RawIOBase):
+    """
+    A file-like object reading an iterator of byte blocks. Reads move an
+    offset into a view of the current block instead of slicing it, so a
+    block is never copied again, however small the reads.
+    """
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self.blocks = blocks
+        self.pending = memoryview(b"")
+        self.offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while self.offset == len(self.pending):
+            block = next(self.blocks, b"")
+            if not block:
+                return 0
+            self.pending, self.offset = memoryview(block), 0
+        size = min(len(buffer), len(self.pending) - self.offset)
+        buffer[:size] = self.pending[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+
+def load_rentals(
+    paths: Sequence[Union[str, Path]],
+    connection: Any,
+    table: str = "bikemi_source_data",
+    n_jobs: Optional[int] = None,
+    aliases: Optional[Dict[str, str]] = None,
+    min_duration: Optional[pd.Timedelta] = MIN_DURATION,
+    dayfirst: bool = False,
+    date_format: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Loads the yearly exports into Postgres with a single binary COPY.
+
+    The files are read, typed, filtered and encoded in parallel (one per
+    worker process); the COPY streams each file as soon as it is ready,
+    in a single transaction. Only a file per worker (plus one) is
+    submitted at a time, and each encoded block is dropped once copied,
+    so the memory does not grow with the number of files.
+
+    Args:
+    paths (list): the .xlsx or .csv exports.
+
+    connection: the psycopg2 connection.
+
+    table (str, optional): the target table, with the columns of
+    `RENTALS_SCHEMA` (durata_noleggio must not be a generated column).
+
+    n_jobs (int, optional): the number of worker processes.
+
+    aliases (dict, optional): see `read_export()`.
+
+    min_duration (pd.Timedelta, optional): see `prepare_rentals()`.
+
+    dayfirst (bool, optional): dates are written day first.
+
+    date_format (str, optional): see `prepare_rentals()`.
+
+    Returns:
+    [pd.DataFrame]: for each file, the rows read and loaded, the dates that
+    could not be parsed and the seconds spent preparing them; the COPY
+    time is in `attrs["copy_seconds"]`.
+    """
+    tasks = iter([
+        (Path(path), aliases, min_duration, dayfirst, date_format)
+        for path in paths
+    ])
+    max_pending = (n_jobs or os.cpu_count() or 1) + 1
+    report = []
+
+    def blocks(executor: ProcessPoolExecutor) -> Iterator[bytes]:
+        yield PGCOPY_HEADER
+        pending = {
+            executor.submit(_load_export, task)
+            for task in itertools.islice(tasks, max_pending)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, rows_read, rows_loaded, unparsed, seconds, encoded = \
+                    future.result()
+                report.append(
+                    (path.name, rows_read, rows_loaded, unparsed, seconds)
+                )
+                pending.update(
+                    executor.submit(_load_export, task)
+                    for task in itertools.islice(tasks, 1)
+                )
+                # the future holds the same list: emptying it frees
+                # each block as soon as it is copied
+                encoded.reverse()
+                while encoded:
+                    yield encoded.pop()
+        yield PGCOPY_TRAILER
+
+    columns = ", ".join(RENTALS_SCHEMA)
+    copy = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)"
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    copy, io.BufferedReader(_BlocksReader(blocks(executor)))
+                )
+    copy_seconds = time.perf_counter() - start
+
+    output = pd.DataFrame(
+        report,
+        columns=["file", "rows_read", "rows_loaded", "unparsed_dates",
+                 "seconds"]
+    ).set_index("file")
+    output.attrs["copy_seconds"] = copy_seconds
+    return output
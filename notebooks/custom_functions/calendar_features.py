@@ -0,0 +1,436 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import holidays
+
+# for type stubs
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+
+# label used for the days that are not holidays, as in the notebooks
+NO_HOLIDAY = "None"
+
+# maximum number of (country, province, years) tables kept in memory
+HOLIDAY_CACHE_SIZE = 32
+
+# maximum number of indexes whose calendar features are kept in memory
+CALENDAR_CACHE_SIZE = 64
+
+# nanoseconds in one day and in one hour
+DAY_NS = 86_400 * 10**9
+HOUR_NS = 3_600 * 10**9
+
+DAY_NAMES = np.array([
+    "Monday", "Tuesday", "Wednesday", "Thursday",
+    "Friday", "Saturday", "Sunday"
+])
+
+MONTH_NAMES = np.array([
+    "January", "February", "March", "April", "May", "June", "July",
+    "August", "September", "October", "November", "December"
+])
+
+# feature names accepted by `calendar_features` and the column they fill
+FEATURE_COLUMNS = {
+    "hour": "hour",
+    "day": "day",
+    "day_names": "day_name",
+    "weekday": "weekday",
+    "weekends": "is_weekend",
+    "week": "week",
+    "month": "month",
+    "month_name": "month_name",
+    "year": "year",
+    "holidays": "holiday",
+}
+
+
+@functools.lru_cache(maxsize=HOLIDAY_CACHE_SIZE)
+def holiday_table(
+    country: str,
+    prov: str,
+    first_year: int,
+    last_year: int
+) -> Tuple[np.ndarray, np.ndarray, Tuple[str, ...]]:
+    """
+    Precomputes a dense day -> holiday lookup table.
+
+    The table covers every day from the first of January of `first_year`
+    to the 31st of December of `last_year`, and stores for each day
+    the code of the holiday category (the index into `categories`).
+    Tables are cached (least recently used ones are evicted first),
+    so a given (country, province, years) combination is computed once.
+
+    Args:
+    country (str): ISO code of the country, e.g. "IT".
+    prov (str): code of the province, e.g. "MI".
+    first_year, last_year (int): the (inclusive) range of years to cover.
+
+    Returns:
+    [tuple]: the day number (days since the epoch) of the first day
+    in the table, the read-only array of category codes (one per day)
+    and the tuple of categories, with `NO_HOLIDAY` first.
+    """
+    country_holidays = holidays.CountryHoliday(
+        country,
+        prov=prov,
+        years=list(range(first_year, last_year + 1))
+    )
+
+    first_day = np.datetime64(f"{first_year}-01-01", "D")
+    last_day = np.datetime64(f"{last_year + 1}-01-01", "D")
+
+    categories = (NO_HOLIDAY,) + tuple(sorted(set(country_holidays.values())))
+    category_codes = {name: code for code, name in enumerate(categories)}
+
+    codes = np.zeros((last_day - first_day).astype(int), dtype=np.int16)
+    for day, name in country_holidays.items():
+        codes[(np.datetime64(day, "D") - first_day).astype(int)] = \
+            category_codes[name]
+
+    codes.setflags(write=False)
+
+    return first_day.astype(np.int64), codes, categories
+
+
+def holiday_calendar(
+    index: pd.DatetimeIndex,
+    country: str = "IT",
+    prov: str = "MI"
+) -> pd.Categorical:
+    """
+    Maps every timestamp of a DateTimeIndex to its holiday category.
+
+    Timestamps are normalised to their (local) day number and looked up
+    in the cached `holiday_table` in one vectorised step, so there are
+    no per-row Python calls. Days that are not holidays are labelled
+    `NO_HOLIDAY`, missing timestamps (NaT) are left missing.
+    """
+    if index.tz is not None:
+        # use the wall time of the index, not the UTC one
+        index = index.tz_localize(None)
+
+    missing = index.isna()
+
+    if missing.all():
+        return pd.Categorical.from_codes(
+            np.full(len(index), -1), categories=[NO_HOLIDAY]
+        )
+
+    years = index.year[~missing]
+    first_day, table, categories = holiday_table(
+        country, prov, int(years.min()), int(years.max())
+    )
+
+    # casting to days normalises the timestamps (also the ones before 1970)
+    days = index.values.astype("datetime64[D]").astype(np.int64) - first_day
+    days[missing] = 0
+
+    codes = table[days]
+    if missing.any():
+        codes = np.where(missing, -1, codes)
+
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _civil_from_days(
+    days: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Converts day numbers (days since 1970-01-01) to proleptic Gregorian
+    year, month, day of the month and (zero-based) day of the year,
+    with integer arithmetic only (H. Hinnant's `civil_from_days`).
+    """
+    z = days + 719_468
+    era = z // 146_097
+    day_of_era = z - era * 146_097
+    year_of_era = (
+        day_of_era - day_of_era // 1_460
+        + day_of_era // 36_524 - day_of_era // 146_096
+    ) // 365
+    # day of the year, counting from the first of March
+    day_of_year = day_of_era - (
+        365 * year_of_era + year_of_era // 4 - year_of_era // 100
+    )
+    month_from_march = (5 * day_of_year + 2) // 153
+
+    day = day_of_year - (153 * month_from_march + 2) // 5 + 1
+    month = np.where(month_from_march < 10,
+                     month_from_march + 3,
+                     month_from_march - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+
+    is_leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    ordinal = np.where(month <= 2,
+                       day_of_year - 306,
+                       day_of_year + 59 + is_leap)
+
+    return year, month, day, ordinal
+
+
+def _compact_codes(
+    values: np.ndarray,
+    lowest: int,
+    highest: int,
+    observed: Optional[np.ndarray] = None,
+    labels: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes integers in [lowest, highest] as categorical codes.
+
+    Only the values flagged by `observed` (all of them by default) become
+    categories, as `.astype("category")` would do, and the codes are
+    stored with the smallest integer dtype.
+
+    Returns:
+    [tuple]: the codes and the categories.
+    """
+    offsets = values - lowest
+
+    is_category = np.zeros(highest - lowest + 1, dtype=bool)
+    is_category[offsets if observed is None else offsets[observed]] = True
+
+    dtype = np.int8 if is_category.sum() < 128 else np.int16
+    codes = (np.cumsum(is_category) - 1).astype(dtype)[offsets]
+
+    if labels is None:
+        dtype = np.int8 if -128 <= lowest and highest < 128 else np.int16
+        categories = np.arange(lowest, highest + 1, dtype=dtype)[is_category]
+    else:
+        categories = labels[is_category]
+
+    return codes, categories
+
+
+def calendar_features(
+    index: pd.DatetimeIndex,
+    features: Sequence[str] = ("day", "month"),
+    country: str = "IT",
+    prov: str = "MI"
+) -> pd.DataFrame:
+    """
+    Extracts calendar features from a DateTimeIndex in a single pass.
+
+    All the components are derived with integer arithmetic from the
+    underlying int64 array of timestamps: the index is never converted
+    to Python objects and `isocalendar()` is never called. Day-level
+    components are computed once per day and gathered back, and every
+    feature is returned as a categorical with int8/int16 codes.
+
+    Args:
+    index (pd.DatetimeIndex): the index to extract the features from.
+    Timezone-aware indexes are converted to their wall time.
+
+    features (list, optional): the features to extract.
+    Possible values (and the column they fill), as in `create_ts_features`:
+    "hour", "day", "day_names" ("day_name"), "weekday" (Monday is 0),
+    "weekends" ("is_weekend"), "week" (ISO week), "month", "month_name",
+    "year", "holidays" ("holiday").
+
+    country, prov (str): used to look up the holidays.
+
+    Returns:
+    [pd.DataFrame]: one column per feature, indexed by `index`.
+    """
+    unknown = set(features) - set(FEATURE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown calendar features: {sorted(unknown)}")
+
+    wall_time = index if index.tz is None else index.tz_localize(None)
+
+    missing = np.asarray(index.isna())
+    if missing.all():
+        # nothing to extract: keep the columns, all missing
+        return pd.DataFrame(
+            {FEATURE_COLUMNS[feature]: pd.Categorical([None] * len(index))
+             for feature in FEATURE_COLUMNS if feature in features},
+            index=index
+        )
+
+    timestamps = wall_time.values.astype("datetime64[ns]", copy=False) \
+        .view(np.int64)
+    if missing.any():
+        timestamps = np.where(missing, timestamps[~missing].min(), timestamps)
+    else:
+        missing = None
+
+    def categorical(
+        codes: np.ndarray,
+        categories: np.ndarray
+    ) -> pd.Categorical:
+        if missing is not None:
+            codes = np.where(missing, -1, codes)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    days = timestamps // DAY_NS
+    columns: Dict[str, pd.Categorical] = {}
+
+    if "hour" in features:
+        hours = ((timestamps - days * DAY_NS) // HOUR_NS).astype(np.int8)
+        observed = None if missing is None else ~missing
+        columns["hour"] = categorical(
+            *_compact_codes(hours, 0, 23, observed)
+        )
+
+    # the calendar components only depend on the day: compute them (and
+    # their codes) once per day spanned by the index, then gather them back
+    first_day, last_day = days.min(), days.max()
+    if last_day - first_day < len(days):
+        day_numbers = np.arange(first_day, last_day + 1)
+        positions = days - first_day
+        observed_days = np.zeros(len(day_numbers), dtype=bool)
+        observed_days[
+            positions if missing is None else positions[~missing]
+        ] = True
+    else:
+        day_numbers, positions = days, None
+        observed_days = None if missing is None else ~missing
+
+    def by_day(
+        values_by_day: np.ndarray,
+        lowest: int,
+        highest: int,
+        labels: Optional[np.ndarray] = None
+    ) -> pd.Categorical:
+        codes, categories = _compact_codes(
+            values_by_day, lowest, highest, observed_days, labels
+        )
+        if positions is not None:
+            codes = codes[positions]
+        return categorical(codes, categories)
+
+    weekday = (day_numbers + 3) % 7  # 1970-01-01 was a Thursday
+
+    if "weekday" in features:
+        columns["weekday"] = by_day(weekday, 0, 6)
+
+    if "day_names" in features:
+        columns["day_name"] = by_day(weekday, 0, 6, labels=DAY_NAMES)
+
+    if "weekends" in features:
+        columns["is_weekend"] = by_day((weekday >= 5).astype(np.int8), 0, 1)
+
+    if {"day", "month", "month_name", "year"} & set(features):
+        year, month, day, _ = _civil_from_days(day_numbers)
+
+        if "day" in features:
+            columns["day"] = by_day(day, 1, 31)
+
+        if "month" in features:
+            columns["month"] = by_day(month, 1, 12)
+
+        if "month_name" in features:
+            columns["month_name"] = by_day(month, 1, 12, labels=MONTH_NAMES)
+
+        if "year" in features:
+            columns["year"] = by_day(year, int(year.min()), int(year.max()))
+
+    if "week" in features:
+        # the ISO week is the one of the Thursday of the same week
+        _, _, _, thursday_ordinal = _civil_from_days(
+            day_numbers - weekday + 3
+        )
+        columns["week"] = by_day(thursday_ordinal // 7 + 1, 1, 53)
+
+    if "holidays" in features:
+        columns["holiday"] = holiday_calendar(index, country, prov)
+
+    return pd.DataFrame(
+        {
+            FEATURE_COLUMNS[feature]: columns[FEATURE_COLUMNS[feature]]
+            for feature in FEATURE_COLUMNS if feature in features
+        },
+        index=index
+    )
+
+
+# (index fingerprint, country, province) -> {column: (codes, categories)}
+_calendar_cache: OrderedDict = OrderedDict()
+_calendar_cache_lock = threading.Lock()
+
+
+def index_fingerprint(index: pd.DatetimeIndex) -> Tuple[Hashable, ...]:
+    """
+    Identifies a DateTimeIndex by its start, end, frequency, timezone
+    and length. Indexes without a frequency (e.g. the ones read from
+    the database) could share all of these and still differ, so their
+    fingerprint also includes a digest of the timestamps, in order: the
+    same timestamps in another order are another index.
+    """
+    fingerprint = (
+        index.min() if len(index) else None,
+        index.max() if len(index) else None,
+        index.freqstr,
+        str(index.tz),
+        len(index),
+    )
+
+    if index.freq is None:
+        fingerprint += (hashlib.blake2b(
+            np.ascontiguousarray(index.asi8).tobytes(), digest_size=16
+        ).hexdigest(),)
+
+    return fingerprint
+
+
+def clear_calendar_cache() -> None:
+    """Drops all the calendar features kept by `cached_calendar_features`."""
+    with _calendar_cache_lock:
+        _calendar_cache.clear()
+
+
+def cached_calendar_features(
+    index: pd.DatetimeIndex,
+    features: Sequence[str] = ("day", "month"),
+    country: str = "IT",
+    prov: str = "MI"
+) -> pd.DataFrame:
+    """
+    Memoised version of `calendar_features`.
+
+    Features are cached by `index_fingerprint`, in a LRU cache holding
+    up to `CALENDAR_CACHE_SIZE` indexes: calling this for every station
+    (or cluster) on the same date range computes each feature once.
+    The categorical codes are shared across calls and read-only,
+    so the columns cannot be modified in place by mistake.
+    """
+    key = (index_fingerprint(index), country, prov)
+
+    with _calendar_cache_lock:
+        cached = _calendar_cache.get(key, {})
+        if key in _calendar_cache:
+            _calendar_cache.move_to_end(key)
+
+    to_compute = [
+        feature for feature in features
+        if FEATURE_COLUMNS.get(feature, feature) not in cached
+    ]
+
+    if to_compute:
+        computed = calendar_features(index, to_compute, country, prov)
+        new_columns = {}
+        for col in computed.columns:
+            codes = computed[col].cat.codes.to_numpy()
+            codes.setflags(write=False)
+            new_columns[col] = (codes, computed[col].cat.categories)
+
+        with _calendar_cache_lock:
+            cached = {**_calendar_cache.get(key, {}), **new_columns}
+            _calendar_cache[key] = cached
+            _calendar_cache.move_to_end(key)
+            while len(_calendar_cache) > CALENDAR_CACHE_SIZE:
+                _calendar_cache.popitem(last=False)
+
+    return pd.DataFrame(
+        {
+            FEATURE_COLUMNS[feature]: pd.Categorical.from_codes(
+                *cached[FEATURE_COLUMNS[feature]]
+            )
+            for feature in FEATURE_COLUMNS if feature in features
+        },
+        index=index,
+        copy=False
+    )
@@ -0,0 +1,709 @@
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import geopandas
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+# for type stubs
+from typing import (
+    Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+)
+
+from sklearn.cluster import KMeans
+from sklearn.metrics import (
+    calinski_harabasz_score,
+    davies_bouldin_score,
+    pairwise_distances,
+    pairwise_distances_chunked,
+    silhouette_score
+)
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+from custom_functions.facility_features import METRIC_CRS
+
+METRICS = [
+    "inertia", "silhouette_coefficient", "calinski_harabasz", "davies_bouldin"
+]
+
+SILHOUETTE_METHODS = ("auto", "exact", "sampled", "centroid")
+
+# above this many points, "auto" switches from the exact to the sampled
+# silhouette (the exact one needs the n x n distance matrix)
+MAX_EXACT_SILHOUETTE = 5_000
+
+# default number of points drawn by the sampled silhouette
+SILHOUETTE_SAMPLE_SIZE = 2_000
+
+# the nearest centres tried by the capacity-constrained assignment before
+# falling back to all of them
+CAPACITY_CANDIDATES = 8
+
+Metrics = Tuple[float, ...]
+
+# data shared by the sweep workers, set once per process by `_init_sweep`
+_sweep_data: Dict[str, Any] = {}
+
+
+def _stratified_sample(
+    labels: np.ndarray,
+    sample_size: int,
+    rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Draws about `sample_size` points, proportionally to the size of each
+    cluster but with at least two points per cluster (or the whole cluster
+    if smaller). Returns the positions, the cluster of each draw and the
+    number of draws per cluster.
+    """
+    clusters, sizes = np.unique(labels, return_counts=True)
+    draws = np.minimum(
+        sizes,
+        np.maximum(np.round(sample_size * sizes / sizes.sum()), 2)
+    ).astype(int)
+
+    order = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    positions = np.concatenate([
+        order[start + rng.choice(size, n_draws, replace=False)]
+        for start, size, n_draws in zip(starts, sizes, draws)
+    ])
+
+    return positions, np.repeat(np.arange(len(clusters)), draws), draws
+
+
+def sampled_silhouette(
+    data: np.ndarray,
+    labels: np.ndarray,
+    sample_size: int = SILHOUETTE_SAMPLE_SIZE,
+    random_state: Optional[int] = None
+) -> Tuple[float, float]:
+    """
+    Estimates the silhouette coefficient from a stratified sample of points.
+
+    The silhouette of each sampled point is exact (its distances to all the
+    points are computed), so the cost is O(sample_size * n) instead of
+    O(n ** 2); the distances are summed by cluster one block of sampled
+    points at a time, so the memory does not grow with n * sample_size.
+    Clusters are the strata: the estimate weights each cluster by its size,
+    and its standard error includes the finite population correction.
+
+    Args:
+    data (np.ndarray): the (scaled) features.
+
+    labels (np.ndarray): the cluster of each point.
+
+    sample_size (int, optional): the number of points to draw.
+
+    random_state (int, optional): the seed of the draws.
+
+    Returns:
+    [tuple]: the estimated silhouette coefficient and its standard error.
+    """
+    data = np.asarray(data, dtype=float)
+    _, labels = np.unique(labels, return_inverse=True)
+    if sample_size >= len(data):
+        return silhouette_score(data, labels), 0.0
+
+    rng = np.random.default_rng(random_state)
+    positions, strata, draws = _stratified_sample(labels, sample_size, rng)
+    sizes = np.bincount(labels)
+
+    # sum of the distances of each sampled point to each cluster, a block
+    # of sampled points at a time (the m x n distances are never stored):
+    # with the points sorted by cluster, each cluster is a run of columns
+    order = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    sums = np.vstack(list(pairwise_distances_chunked(
+        data[positions], data[order],
+        reduce_func=lambda block, _: np.add.reduceat(block, starts, axis=1)
+    )))
+
+    own = sizes[strata]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        within = sums[np.arange(len(positions)), strata] / (own - 1)
+        means = sums / sizes
+    means[np.arange(len(positions)), strata] = np.inf
+    between = means.min(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = (between - within) / np.maximum(within, between)
+    # points alone in their cluster score 0, as in scikit-learn
+    scores = np.where(own > 1, np.nan_to_num(scores), 0.0)
+
+    weights = sizes / sizes.sum()
+    stratum_means = np.bincount(strata, scores) / draws
+    stratum_variances = np.bincount(
+        strata, (scores - stratum_means[strata]) ** 2
+    ) / np.maximum(draws - 1, 1)
+    variance = np.sum(
+        weights ** 2 * stratum_variances / draws * (1 - draws / sizes)
+    )
+
+    return float(weights @ stratum_means), float(np.sqrt(variance))
+
+
+def centroid_silhouette(
+    data: np.ndarray,
+    labels: np.ndarray,
+    centres: Optional[np.ndarray] = None
+) -> float:
+    """
+    Simplified silhouette (Hruschka et al., 2004): the mean distance to the
+    own cluster and to the closest other cluster are replaced by the
+    distances to their centroids, so the cost is O(n * k).
+
+    Args:
+    data (np.ndarray): the (scaled) features.
+
+    labels (np.ndarray): the cluster of each point, from 0 to k - 1.
+
+    centres (np.ndarray, optional): the centroids, e.g. the k-means
+    `cluster_centers_`. Computed from the data if missing.
+    """
+    data = np.asarray(data, dtype=float)
+    if centres is None:
+        _, labels = np.unique(labels, return_inverse=True)
+        centres = np.vstack([
+            data[labels == cluster].mean(axis=0)
+            for cluster in range(labels.max() + 1)
+        ])
+
+    distances = pairwise_distances(data, centres)
+    rows = np.arange(len(data))
+    within = distances[rows, labels]
+    distances[rows, labels] = np.inf
+    between = distances.min(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.nan_to_num(
+            (between - within) / np.maximum(within, between)
+        )
+
+    return float(scores.mean())
+
+
+def _init_sweep(
+    scaled_data: np.ndarray,
+    distances: Optional[Union[np.ndarray, str]],
+    silhouette: str,
+    sample_size: int
+) -> None:
+    _sweep_data["scaled_data"] = scaled_data
+    # a path is memory-mapped: the workers share the pages of one file
+    # instead of each unpickling its own copy
+    _sweep_data["distances"] = np.load(distances, mmap_mode="r") \
+        if isinstance(distances, str) else distances
+    _sweep_data["silhouette"] = silhouette
+    _sweep_data["sample_size"] = sample_size
+
+
+def _add_farthest_centre(data: np.ndarray, centres: np.ndarray) -> np.ndarray:
+    """
+    Warm start for k + 1 clusters: keeps the k centres and adds the point
+    farthest from its closest centre (deterministic k-means++ step).
+    """
+    closest = pairwise_distances(data, centres).min(axis=1)
+    return np.vstack([centres, data[np.argmax(closest)]])
+
+
+def _sweep_scores(
+    task: Tuple[int, Sequence[int], bool]
+) -> List[Tuple[int, int, Metrics]]:
+    """Fits k-means for each k of a task and computes the metrics."""
+    seed, k_values, warm_start = task
+    data = _sweep_data["scaled_data"]
+    silhouette = _sweep_data["silhouette"]
+
+    scores = []
+    centres: Optional[np.ndarray] = None
+    with threadpool_limits(limits=1):
+        for k in k_values:
+            if warm_start and centres is not None and len(centres) == k - 1:
+                kmeans = KMeans(
+                    k, init=_add_farthest_centre(data, centres), n_init=1,
+                    random_state=seed
+                ).fit(data)
+            else:
+                kmeans = KMeans(k, random_state=seed).fit(data)
+            centres = kmeans.cluster_centers_
+
+            if silhouette == "exact":
+                silhouette_scores: Tuple[float, ...] = (silhouette_score(
+                    _sweep_data["distances"], kmeans.labels_,
+                    metric="precomputed"
+                ),)
+            elif silhouette == "sampled":
+                silhouette_scores = sampled_silhouette(
+                    data, kmeans.labels_, _sweep_data["sample_size"], seed
+                )
+            else:
+                silhouette_scores = (centroid_silhouette(
+                    data, kmeans.labels_, kmeans.cluster_centers_
+                ),)
+
+            scores.append((seed, k, (
+                kmeans.inertia_,
+                silhouette_scores[0],
+                calinski_harabasz_score(data, kmeans.labels_),
+                davies_bouldin_score(data, kmeans.labels_),
+                *silhouette_scores[1:],
+            )))
+
+    return scores
+
+
+def get_kmeans_metrics(
+    data: pd.DataFrame,
+    k_max: int,
+    random_state: Union[int, Sequence[int]],
+    n_jobs: Optional[int] = None,
+    warm_start: bool = False,
+    silhouette: str = "auto",
+    max_exact_silhouette: int = MAX_EXACT_SILHOUETTE,
+    sample_size: int = SILHOUETTE_SAMPLE_SIZE
+) -> pd.DataFrame:
+    """
+    Fits k-means for k from 2 to `k_max` on the standardised data and
+    collects inertia, silhouette coefficient, Calinski-Harabasz and
+    Davies-Bouldin indexes for each k.
+
+    For the exact silhouette, the pairwise distance matrix is computed once
+    and used by all the silhouette computations; the workers memory-map it
+    from a temporary .npy file, so it is in memory once, whatever the
+    number of workers. The values of k (for each seed) are spread across
+    a process pool.
+
+    Args:
+    data (pd.DataFrame): the features, e.g. stalls longitude and latitude.
+
+    k_max (int): the largest number of clusters.
+
+    random_state (int or list of ints): the seed(s) of k-means.
+
+    n_jobs (int, optional): number of worker processes. Defaults to the
+    number of CPUs; 1 runs the sweep in this process.
+
+    warm_start (bool, optional): initialise k-means for k with the centres
+    found for k - 1, plus the point farthest from them. Each seed is then
+    swept sequentially (seeds still run in parallel), with a single
+    initialisation per k, which is much faster for large `k_max`.
+
+    silhouette (str, optional): "exact", "sampled" (see
+    `sampled_silhouette`), "centroid" (see `centroid_silhouette`) or "auto",
+    the default: exact up to `max_exact_silhouette` points, sampled above.
+
+    max_exact_silhouette (int, optional): the largest number of points
+    for which "auto" computes the exact silhouette.
+
+    sample_size (int, optional): the number of points drawn by the sampled
+    silhouette, with the k-means seed.
+
+    Returns:
+    [pd.DataFrame]: the metrics, indexed by k (by seed and k if more than
+    one seed is given). The sampled silhouette adds its standard error,
+    as "silhouette_std_error".
+    """
+    if silhouette not in SILHOUETTE_METHODS:
+        raise ValueError(f"Unknown silhouette method: {silhouette}")
+
+    scaled_data = StandardScaler().fit_transform(data)
+    if silhouette == "auto":
+        silhouette = "exact" if len(scaled_data) <= max_exact_silhouette \
+            else "sampled"
+    distances = pairwise_distances(scaled_data) \
+        if silhouette == "exact" else None
+
+    seeds = [random_state] if np.isscalar(random_state) else list(random_state)
+    k_range = list(range(2, k_max + 1))
+
+    if warm_start:
+        tasks = [(seed, k_range, True) for seed in seeds]
+    else:
+        # interleave the values of k, so that every task gets some large k
+        n_chunks = min(len(k_range), 4 * (n_jobs or 8))
+        tasks = [
+            (seed, k_range[first::n_chunks], False)
+            for seed in seeds for first in range(n_chunks)
+        ]
+
+    if n_jobs == 1:
+        _init_sweep(scaled_data, distances, silhouette, sample_size)
+        results = [_sweep_scores(task) for task in tasks]
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            distances_file = None
+            if distances is not None:
+                distances_file = str(Path(directory) / "distances.npy")
+                np.save(distances_file, distances)
+                del distances
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_init_sweep,
+                initargs=(scaled_data, distances_file, silhouette, sample_size)
+            ) as executor:
+                results = list(executor.map(_sweep_scores, tasks))
+
+    scores = sorted(score for result in results for score in result)
+
+    columns = METRICS.copy()
+    if silhouette == "sampled":
+        columns.append("silhouette_std_error")
+
+    output = pd.DataFrame(
+        [metrics for _, _, metrics in scores],
+        index=pd.MultiIndex.from_tuples(
+            [(seed, k) for seed, k, _ in scores], names=["seed", "k"]
+        ),
+        columns=columns
+    )
+
+    if len(seeds) == 1:
+        output = output.droplevel("seed")
+
+    return output
+
+
+class ClusterUpdate(NamedTuple):
+    clusters: pd.DataFrame
+    diff: pd.DataFrame
+
+
+def update_clusters(
+    clusters: pd.DataFrame,
+    stations: pd.DataFrame,
+    nils: geopandas.GeoDataFrame,
+    cols: Sequence[str] = ("longitudine", "latitudine")
+) -> ClusterUpdate:
+    """
+    Updates the virtual stalls after stations are added, removed or moved,
+    without refitting k-means.
+
+    New (and moved) stations go to the closest virtual stall, measured on
+    the standardised coordinates as k-means did. The centroids of the
+    virtual stalls that gained or lost stations are then updated from the
+    running sums of their members' coordinates, so they are still the
+    mean of the stations in the cluster (virtual stalls left empty are
+    dropped). Only the updated virtual stalls are joined again with the
+    NILs.
+
+    Args:
+    clusters (pd.DataFrame): the current assignment, laid out as
+    "bikemi-selected_stalls-clusters.csv" and indexed by "numero_stazione".
+
+    stations (pd.DataFrame): the current stations, indexed by
+    "numero_stazione", with their name and coordinates.
+
+    nils (geopandas.GeoDataFrame): the NILs, indexed by "id_nil", with
+    "nil" and "geometry" columns.
+
+    cols (list, optional): the longitude and latitude columns.
+
+    Returns:
+    [ClusterUpdate]: the updated assignment, in the same layout, and the
+    diff of the membership: one row per added, removed or moved station,
+    with its old and new cluster.
+    """
+    cols = list(cols)
+    # the scale of the coordinates k-means was fitted on
+    scale = clusters[cols].std(ddof=0).to_numpy()
+
+    old_stations = clusters.index.intersection(stations.index)
+    moved = old_stations[
+        (clusters.loc[old_stations, cols] != stations.loc[old_stations, cols])
+        .any(axis=1).to_numpy()
+    ]
+    removed = clusters.index.difference(stations.index).union(moved)
+    added = stations.index.difference(clusters.index).union(moved)
+
+    if removed.empty and added.empty:
+        return ClusterUpdate(clusters, pd.DataFrame(
+            columns=["old_cluster", "new_cluster", "change"],
+            index=pd.Index([], name=clusters.index.name)
+        ))
+
+    # running count and sum of the coordinates of each virtual stall
+    kept = clusters.drop(index=removed)
+    sums = kept.groupby("cluster")[cols].sum()
+    counts = kept.groupby("cluster").size()
+
+    # assign the new stations to the closest centroid (before the update)
+    centroids = clusters.groupby("cluster")[
+        ["lon_cluster", "lat_cluster"]
+    ].first()
+    centroids = centroids.loc[centroids.index.isin(counts.index)]
+    new_points = stations.loc[added, cols].to_numpy()
+    new_clusters = centroids.index.to_numpy()[:0]
+    if len(new_points):
+        distances = pairwise_distances(
+            new_points / scale, centroids.to_numpy() / scale
+        )
+        new_clusters = centroids.index.to_numpy()[distances.argmin(axis=1)]
+
+    additions = pd.DataFrame(new_points, index=added, columns=cols) \
+        .assign(cluster=new_clusters)
+    sums = sums.add(additions.groupby("cluster")[cols].sum(), fill_value=0)
+    counts = counts.add(additions.groupby("cluster").size(), fill_value=0)
+
+    changed = pd.Index(np.union1d(
+        clusters.loc[removed, "cluster"], new_clusters
+    )).intersection(counts.index)
+
+    # new centroids and NILs, only for the virtual stalls that changed
+    updated = sums.loc[changed].div(counts.loc[changed], axis=0)
+    updated_nils = geopandas.GeoDataFrame(
+        updated,
+        geometry=geopandas.points_from_xy(
+            updated[cols[0]], updated[cols[1]], crs=nils.crs
+        )
+    ).sjoin(nils, how="left")
+    # a point on the border of two NILs keeps the first match
+    updated_nils = updated_nils[~updated_nils.index.duplicated()]
+    # geopandas < 0.11 always names the right index "index_right"
+    id_nil = nils.index.name if nils.index.name in updated_nils \
+        else "index_right"
+
+    virtual_stalls = clusters.groupby("cluster")[
+        ["lon_cluster", "lat_cluster", "cluster_id_nil", "cluster_nil"]
+    ].first().loc[counts.index]
+    virtual_stalls.loc[changed, "lon_cluster"] = updated[cols[0]]
+    virtual_stalls.loc[changed, "lat_cluster"] = updated[cols[1]]
+    virtual_stalls.loc[changed, "cluster_id_nil"] = \
+        updated_nils[id_nil]
+    virtual_stalls.loc[changed, "cluster_nil"] = updated_nils["nil"]
+
+    members = pd.concat([
+        kept[["nome_stazione", *cols, "cluster"]],
+        stations.loc[added, ["nome_stazione", *cols]]
+        .assign(cluster=new_clusters)
+    ])
+    updated_clusters = members.join(virtual_stalls, on="cluster") \
+        .reindex(stations.index)
+
+    diff = pd.DataFrame({
+        "old_cluster": clusters["cluster"].reindex(removed.union(added)),
+        "new_cluster": updated_clusters["cluster"].reindex(
+            removed.union(added)
+        ),
+    })
+    diff["change"] = np.select(
+        [diff.index.isin(moved), diff.index.isin(added)],
+        ["moved", "added"],
+        "removed"
+    )
+
+    return ClusterUpdate(updated_clusters, diff)
+
+
+def _allocate_clusters(
+    group_sizes: pd.Series,
+    k: int,
+    max_size: Optional[int] = None
+) -> pd.Series:
+    """
+    Splits `k` clusters among groups of points: each group gets at least
+    one cluster (and enough to respect `max_size`), then each further
+    cluster goes to the group with the most points per cluster.
+    """
+    if k > group_sizes.sum():
+        raise ValueError(f"{k} clusters for {group_sizes.sum()} points")
+
+    allocation = pd.Series(1, index=group_sizes.index)
+    if max_size is not None:
+        allocation = np.ceil(group_sizes / max_size).astype(int)
+    if allocation.sum() > k:
+        raise ValueError(
+            f"{k} clusters are too few: the constraints need at least "
+            f"{allocation.sum()}"
+        )
+
+    for _ in range(k - allocation.sum()):
+        load = (group_sizes / allocation).where(allocation < group_sizes)
+        allocation[load.idxmax()] += 1
+
+    return allocation
+
+
+def _capacity_assign(
+    points: np.ndarray,
+    centres: np.ndarray,
+    max_size: int,
+    n_iter: int = 10
+) -> np.ndarray:
+    """
+    Assigns the points to the nearest centre with room left (at most
+    `max_size` points each), then moves the centres to the mean of their
+    points, until the assignment no longer changes.
+
+    Points are placed by decreasing regret (how much farther their second
+    nearest centre is), so the points with the fewest good options go
+    first; the candidate centres come from a KD-tree query.
+    """
+    n_centres = len(centres)
+    labels = np.full(len(points), -1)
+
+    for _ in range(n_iter):
+        n_candidates = min(CAPACITY_CANDIDATES, n_centres)
+        distances, candidates = cKDTree(centres).query(points, n_candidates)
+        distances = distances.reshape(len(points), n_candidates)
+        candidates = candidates.reshape(len(points), n_candidates)
+        regret = distances[:, -1] - distances[:, 0]
+
+        new_labels = np.full(len(points), -1)
+        sizes = np.zeros(n_centres, dtype=int)
+        for point in np.argsort(-regret, kind="stable"):
+            free = candidates[point][sizes[candidates[point]] < max_size]
+            if not len(free):
+                # all the nearest centres are full: try them all
+                by_distance = np.argsort(
+                    np.hypot(*(centres - points[point]).T)
+                )
+                free = by_distance[sizes[by_distance] < max_size]
+            new_labels[point] = free[0]
+            sizes[free[0]] += 1
+
+        if (new_labels == labels).all():
+            break
+        labels = new_labels
+        for centre in np.flatnonzero(sizes):
+            centres[centre] = points[labels == centre].mean(axis=0)
+
+    return labels
+
+
+def constrained_clusters(
+    stations: pd.DataFrame,
+    k: int,
+    max_size: Optional[int] = None,
+    nil_col: Optional[str] = "id_nil",
+    nils: Optional[geopandas.GeoDataFrame] = None,
+    cols: Sequence[str] = ("longitudine", "latitudine"),
+    crs: int = METRIC_CRS,
+    random_state: int = 42,
+    n_iter: int = 10
+) -> pd.DataFrame:
+    """
+    Clusters the stations into `k` virtual stalls on projected coordinates
+    (metres, so that distances are the same in every direction), with
+    optional constraints on the NILs and on the size of the clusters.
+
+    With `nil_col`, clusters never cross a NIL: the `k` clusters are split
+    among the NILs by number of stations (see `_allocate_clusters()`) and
+    k-means runs within each NIL. With `max_size`, the k-means clusters are
+    then rebalanced so that none has more than `max_size` stations (see
+    `_capacity_assign()`).
+
+    Args:
+    stations (pd.DataFrame): the stations, e.g. as in
+    "bikemi-selected_stalls-with_nils.csv", indexed by "numero_stazione".
+
+    k (int): the number of clusters.
+
+    max_size (int, optional): the most stations in a cluster.
+
+    nil_col (str, optional): the NIL of each station, or None for no NIL
+    constraint.
+
+    nils (geopandas.GeoDataFrame, optional): the NILs, indexed by "id_nil",
+    with "nil" and "geometry" columns, to find the NIL of the virtual
+    stalls without the NIL constraint (or to name the NILs, if `stations`
+    has no "nil" column).
+
+    cols (list, optional): the longitude and latitude columns.
+
+    crs (int, optional): the metric CRS, by default UTM zone 32N.
+
+    random_state (int, optional): the seed of k-means.
+
+    n_iter (int, optional): the most rounds of the capacity constraint.
+
+    Returns:
+    [pd.DataFrame]: laid out as "bikemi-selected_stalls-clusters.csv": the
+    stations with their "cluster", the coordinates of the virtual stall
+    ("lon_cluster", "lat_cluster", the mean of its stations) and its NIL
+    ("cluster_id_nil", "cluster_nil").
+    """
+    cols = list(cols)
+    to_metric = Transformer.from_crs(4326, crs, always_xy=True)
+    points = np.column_stack(to_metric.transform(
+        stations[cols[0]].to_numpy(dtype=float),
+        stations[cols[1]].to_numpy(dtype=float)
+    ))
+
+    groups = stations[nil_col].to_numpy() if nil_col is not None \
+        else np.zeros(len(stations), dtype=int)
+    allocation = _allocate_clusters(
+        pd.Series(groups).value_counts().sort_index(), k, max_size
+    )
+
+    # (group, cluster within the group) of each station
+    local_labels = np.zeros(len(stations), dtype=int)
+    for group, n_clusters in allocation.items():
+        members = np.flatnonzero(groups == group)
+        kmeans = KMeans(n_clusters, random_state=random_state) \
+            .fit(points[members])
+        labels = kmeans.labels_
+        if max_size is not None:
+            labels = _capacity_assign(
+                points[members], kmeans.cluster_centers_.copy(), max_size,
+                n_iter
+            )
+        local_labels[members] = labels
+
+    _, clusters = np.unique(
+        np.column_stack([pd.factorize(groups, sort=True)[0], local_labels]),
+        axis=0, return_inverse=True
+    )
+    clusters = clusters.ravel()
+
+    # the virtual stalls: mean of the projected coordinates, back to lon/lat
+    centres = pd.DataFrame(points).groupby(clusters).mean()
+    to_lonlat = Transformer.from_crs(crs, 4326, always_xy=True)
+    lon_cluster, lat_cluster = to_lonlat.transform(
+        centres[0].to_numpy(), centres[1].to_numpy()
+    )
+    virtual_stalls = pd.DataFrame(
+        {"lon_cluster": lon_cluster, "lat_cluster": lat_cluster},
+        index=pd.Index(centres.index, name="cluster")
+    )
+
+    if nil_col is not None:
+        # the NIL of the stations of the cluster
+        virtual_stalls["cluster_id_nil"] = \
+            pd.Series(groups).groupby(clusters).first()
+        if "nil" in stations:
+            virtual_stalls["cluster_nil"] = \
+                stations["nil"].groupby(clusters).first().to_numpy()
+        elif nils is not None:
+            virtual_stalls["cluster_nil"] = nils["nil"].reindex(
+                virtual_stalls["cluster_id_nil"]
+            ).to_numpy()
+    elif nils is not None:
+        # the NIL the virtual stall falls in
+        located = geopandas.GeoDataFrame(
+            virtual_stalls,
+            geometry=geopandas.points_from_xy(
+                lon_cluster, lat_cluster, crs=4326
+            )
+        ).to_crs(nils.crs).sjoin(nils, how="left")
+        located = located[~located.index.duplicated()]
+        # geopandas < 0.11 always names the right index "index_right"
+        id_nil = nils.index.name if nils.index.name in located \
+            else "index_right"
+        virtual_stalls["cluster_id_nil"] = located[id_nil]
+        virtual_stalls["cluster_nil"] = located["nil"]
+
+    output = stations[[
+        col for col in ["nome_stazione", *cols] if col in stations
+    ]].assign(cluster=clusters)
+    return output.join(
+        virtual_stalls.reindex(
+            columns=["lon_cluster", "lat_cluster", "cluster_id_nil",
+                     "cluster_nil"]
+        ),
+        on="cluster"
+    )
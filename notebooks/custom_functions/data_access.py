@@ -0,0 +1,245 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+
+# for type stubs
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+# the DSN is read from this environment variable, e.g.
+# BIKEMI_DSN="dbname=bikemi user=luca host=localhost"
+DSN_ENV_VAR = "BIKEMI_DSN"
+DEFAULT_DSN = "dbname=bikemi"
+
+MAX_CONNECTIONS = 8
+
+# the SQL predicate of the rentals returned during the commuting hours:
+# Monday to Friday, from 7 to 10 and from 17 to 20
+COMMUTING_FILTER = """
+    EXTRACT("isodow" FROM data_restituzione) BETWEEN 1 AND 5
+    AND (
+        EXTRACT("hour" FROM data_restituzione) BETWEEN 7 AND 10
+        OR EXTRACT("hour" FROM data_restituzione) BETWEEN 17 AND 20
+    )
+"""
+
+USERS_BY_YEAR_QUERY = """
+    SELECT
+        EXTRACT("year" FROM data_prelievo) AS anno,
+        COUNT(DISTINCT cliente_anonimizzato)
+    FROM bikemi_rentals_before_2019
+    GROUP BY EXTRACT("year" FROM data_prelievo);
+"""
+
+Query = Union[str, Tuple[str, Any]]
+
+_pools: Dict[str, ThreadedConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_dsn(dsn: Optional[str] = None) -> str:
+    """The given DSN, or the one in $BIKEMI_DSN, or "dbname=bikemi"."""
+    return dsn or os.environ.get(DSN_ENV_VAR, DEFAULT_DSN)
+
+
+def get_pool(
+    dsn: Optional[str] = None,
+    max_connections: int = MAX_CONNECTIONS
+) -> ThreadedConnectionPool:
+    """The (thread-safe) connection pool of a DSN, created on first use."""
+    dsn = get_dsn(dsn)
+    with _pools_lock:
+        if dsn not in _pools or _pools[dsn].closed:
+            _pools[dsn] = ThreadedConnectionPool(1, max_connections, dsn)
+        return _pools[dsn]
+
+
+def close_pools() -> None:
+    """Closes all the connections of all the pools."""
+    with _pools_lock:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        _pools.clear()
+
+
+@contextmanager
+def pooled_connection(dsn: Optional[str] = None) -> Iterator[Any]:
+    """
+    Borrows a connection from the pool and gives it back afterwards, with
+    its transaction closed (committed, or rolled back on errors).
+    """
+    pool = get_pool(dsn)
+    connection = pool.getconn()
+    try:
+        with connection:
+            yield connection
+    finally:
+        pool.putconn(connection)
+
+
+def read_sql(
+    query: str,
+    params: Optional[Any] = None,
+    dsn: Optional[str] = None,
+    **kwargs: Any
+) -> pd.DataFrame:
+    """`pd.read_sql()` on a pooled connection."""
+    with pooled_connection(dsn) as connection:
+        return pd.read_sql(query, connection, params=params, **kwargs)
+
+
+def run_queries(
+    queries: Dict[str, Query],
+    dsn: Optional[str] = None,
+    max_workers: Optional[int] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Runs independent queries at the same time, each on its own pooled
+    connection (psycopg2 releases the GIL while waiting for the server).
+
+    Args:
+    queries (dict): the queries by name; a query is either a string or
+    a (query, params) tuple.
+
+    dsn (str, optional): see `get_dsn()`.
+
+    max_workers (int, optional): the number of queries running at once,
+    at most the size of the pool.
+
+    Returns:
+    [dict]: the result of each query, by name.
+    """
+    max_workers = min(max_workers or MAX_CONNECTIONS, MAX_CONNECTIONS)
+
+    def run(query: Query) -> pd.DataFrame:
+        sql, params = (query, None) if isinstance(query, str) else query
+        return read_sql(sql, params, dsn)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(run, query)
+            for name, query in queries.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def top_stations_query(colname: str, commuting_hours: bool = False) -> str:
+    """The ten stations with the most rentals in the `colname` column."""
+    where = f"WHERE {COMMUTING_FILTER}" if commuting_hours else ""
+    return f"""
+        SELECT
+            {colname} AS {colname.replace("nome_", "")},
+            COUNT(*) AS numero_noleggi
+        FROM bikemi_rentals_before_2019
+        {where}
+        GROUP BY
+            {colname}
+        ORDER BY numero_noleggi DESC
+        LIMIT 10;
+    """
+
+
+def top_od_query(commuting_hours: bool = False) -> str:
+    """The ten origin-destination pairs with the most rentals."""
+    where = f"WHERE {COMMUTING_FILTER}" if commuting_hours else ""
+    return f"""
+        SELECT
+            nome_stazione_prelievo AS stazione_prelievo,
+            nome_stazione_restituzione AS stazione_destinazione,
+            COUNT(*) AS numero_noleggi
+        FROM bikemi_rentals_before_2019
+        {where}
+        GROUP BY
+            nome_stazione_prelievo,
+            nome_stazione_restituzione
+        ORDER BY numero_noleggi DESC
+        LIMIT 10;
+    """
+
+
+def get_top_stations(
+    cols: List[str],
+    connection: Optional[Any] = None,
+    commuting_hours: bool = False,
+    *,
+    dsn: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    The ten busiest stations for each column (e.g. "nome_stazione_prelievo"
+    and "nome_stazione_restituzione"), side by side.
+
+    Called as in chapter 3, `get_top_stations(cols, conn)`, the queries run
+    one after the other on `connection`; without it, one query per column
+    runs at the same time on the pool of `dsn` (see `run_queries()`).
+    """
+    queries = {col: top_stations_query(col, commuting_hours) for col in cols}
+    if connection is not None:
+        results = {
+            col: pd.read_sql(query, connection)
+            for col, query in queries.items()
+        }
+    else:
+        results = run_queries(queries, dsn)
+    return pd.concat([results[col] for col in cols], axis=1)
+
+
+def get_rentals_overview(
+    commuting_hours: bool = False,
+    dsn: Optional[str] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Top origins, top destinations, top origin-destination pairs and users
+    by year, computed concurrently.
+    """
+    results = run_queries(
+        {
+            "top_origins": top_stations_query(
+                "nome_stazione_prelievo", commuting_hours
+            ),
+            "top_destinations": top_stations_query(
+                "nome_stazione_restituzione", commuting_hours
+            ),
+            "top_od": top_od_query(commuting_hours),
+            "users_by_year": USERS_BY_YEAR_QUERY,
+        },
+        dsn
+    )
+    results["users_by_year"] = results["users_by_year"] \
+        .astype({"anno": "int"}).set_index("anno")
+    return results
+
+
+def rebuild_rentals_counts(
+    first_month: str,
+    last_month: str,
+    dsn: Optional[str] = None,
+    max_workers: Optional[int] = None
+) -> pd.Series:
+    """
+    Rebuilds the station x hour and station x day counts month by month,
+    several months at once: each month only reads its own partition of the
+    rentals (see before_2019-function-rebuild_rentals_counts.sql).
+
+    Returns:
+    [pd.Series]: the number of station x hour cells rebuilt, by month.
+    """
+    months = pd.date_range(first_month, last_month, freq="MS")
+    results = run_queries(
+        {
+            f"{month:%Y-%m}": (
+                "SELECT bikemi_rentals.rebuild_rentals_counts(%s) AS cells",
+                (month.date(),)
+            )
+            for month in months
+        },
+        dsn,
+        max_workers
+    )
+    return pd.Series(
+        {month: result["cells"].iloc[0] for month, result in results.items()},
+        name="cells"
+    ).rename_axis("month")
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# for type stubs
+from typing import Union
+
+# default number of points sent to the plotting libraries
+MAX_POINTS = 2_000
+
+
+def _as_float(index: pd.Index) -> np.ndarray:
+    """x coordinates as floats (timestamps become nanoseconds)."""
+    if isinstance(index, pd.DatetimeIndex):
+        return index.values.astype("datetime64[ns]").view(np.int64) \
+            .astype(float)
+    return np.asarray(index, dtype=float)
+
+
+def min_max_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Min-max decimation: splits the series in `n_out // 2` buckets and keeps
+    the minimum and the maximum of each (plus the first and last point),
+    so that every peak survives. Fully vectorised.
+    """
+    n_buckets = max(n_out // 2 - 1, 1)
+    edges = np.linspace(1, len(y) - 1, n_buckets + 1).astype(int)
+    starts = edges[:-1]
+
+    # argmin/argmax of each bucket, ignoring missing values
+    lowest = np.minimum.reduceat(np.where(np.isnan(y), np.inf, y)[:-1],
+                                 starts)
+    highest = np.maximum.reduceat(np.where(np.isnan(y), -np.inf, y)[:-1],
+                                  starts)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    positions = np.arange(1, len(y) - 1)
+    values = y[1:-1]
+
+    is_min = values == lowest[bucket]
+    is_max = values == highest[bucket]
+    # keep the first occurrence of the extrema in each bucket
+    first_min = np.full(n_buckets, len(y) - 1)
+    first_max = np.full(n_buckets, len(y) - 1)
+    np.minimum.at(first_min, bucket[is_min], positions[is_min])
+    np.minimum.at(first_max, bucket[is_max], positions[is_max])
+
+    return np.unique(np.concatenate([[0, len(y) - 1], first_min, first_max]))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets (Steinarsson, 2013): keeps the first and
+    last points and, from each of `n_out - 2` buckets, the point that makes
+    the largest triangle with the point kept in the previous bucket and the
+    average of the next bucket. Peaks are preserved, as they make the
+    largest triangles.
+    """
+    n_obs = len(y)
+    if n_out >= n_obs or n_out < 3:
+        return np.arange(n_obs)
+
+    edges = np.linspace(1, n_obs - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n_obs - 1
+
+    # the average point of each bucket does not depend on the choices made
+    counts = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / counts,
+                       x[-1])
+    next_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / counts,
+                       y[-1])
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the area of the triangles (previous point, candidate, average)
+        area = np.abs(
+            (x[previous] - next_x[bucket + 1]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y[bucket + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+
+    return kept
+
+
+def downsample_indices(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_out: int = MAX_POINTS,
+    method: str = "lttb"
+) -> np.ndarray:
+    """
+    Positions of the points to keep to draw `y` against `x` with at most
+    `n_out` points, either with "lttb" or with "minmax" decimation.
+
+    Missing values are set aside: the decimation runs on the observed
+    points, and the first missing value of each gap is kept so that
+    gaps are still drawn as such. Gaps take up to half of the budget:
+    beyond that, evenly spaced gaps are kept (the others are narrower
+    than a pixel anyway), and the observed points get the rest.
+    """
+    if method not in ("lttb", "minmax"):
+        raise ValueError(f"Unknown downsampling method: {method}")
+
+    observed = np.flatnonzero(~np.isnan(y))
+    gaps = np.flatnonzero(np.isnan(y[1:]) & ~np.isnan(y[:-1])) + 1
+
+    max_gaps = n_out // 2
+    if len(gaps) > max_gaps:
+        gaps = gaps[
+            np.unique(np.linspace(0, len(gaps) - 1, max_gaps).astype(int))
+        ]
+    budget = n_out - len(gaps)
+
+    if len(observed) <= budget:
+        kept = np.arange(len(observed))
+    elif method == "lttb":
+        kept = lttb_indices(x[observed], y[observed], budget)
+    else:
+        kept = min_max_indices(y[observed], budget)
+
+    return np.union1d(observed[kept], gaps)
+
+
+def downsample(
+    data: Union[pd.Series, pd.DataFrame],
+    n_out: int = MAX_POINTS,
+    method: str = "lttb"
+) -> Union[pd.Series, pd.DataFrame]:
+    """
+    Reduces a time series (or a DataFrame of series sharing the same index)
+    to at most `n_out` points before plotting, preserving peaks.
+
+    For a DataFrame, all the columns must still be drawn against the same
+    x axis, so the points kept for each column are pooled: each of the k
+    columns gets `n_out // k` points (at least 3), and the frame keeps at
+    most `n_out` rows. Short series are returned untouched.
+
+    Args:
+    data (pd.Series or pd.DataFrame): the series to plot, indexed by x.
+    n_out (int, optional): the largest number of points (rows) returned.
+    method (str, optional): "lttb" (Largest-Triangle-Three-Buckets,
+    the default) or "minmax" (keeps the extrema of each bucket).
+    """
+    if len(data) <= n_out:
+        return data
+
+    x = _as_float(data.index)
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    per_column = max(n_out // max(len(frame.columns), 1), 3)
+
+    kept = np.unique(np.concatenate([
+        downsample_indices(
+            x, frame[col].to_numpy(dtype=float), per_column, method
+        )
+        for col in frame.columns
+    ]))
+
+    return data.iloc[kept]
@@ -0,0 +1,221 @@
+import geopandas
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+from custom_functions.layer_store import LayerStore, get_layer
+
+# for type stubs
+from typing import Dict, Optional, Sequence, Tuple
+
+# UTM zone 32N: distances in metres around Milan
+METRIC_CRS = 32632
+
+# the facilities, by feature name, and their layers in the layer store
+FACILITY_LAYERS: Dict[str, str] = {
+    "metro": "metro_stops",
+    "train": "train_stations",
+    "bike_lane": "bike_lanes",
+}
+
+# bike lanes are indexed as points this far apart (in metres): distances
+# to a lane are overestimated by half of it at most
+LANE_SPACING = 10.0
+
+RADII = (250.0, 500.0)
+
+
+def _line_coordinates(geometry: object) -> Sequence[np.ndarray]:
+    # the vertices of each part of a (multi)linestring
+    parts = getattr(geometry, "geoms", [geometry])
+    return [np.asarray(part.coords)[:, :2] for part in parts]
+
+
+def densify_lines(
+    lines: geopandas.GeoSeries,
+    spacing: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Points along the lines (in a metric CRS), at most `spacing` apart:
+    the vertices plus evenly spaced points along each segment.
+
+    Returns:
+    [tuple]: the points, and the length of line each of them stands for
+    (the step of its segment; 0 for the last vertex of a line), which add
+    up to the length of the lines.
+    """
+    parts = [
+        coords
+        for geometry in lines.dropna()
+        for coords in _line_coordinates(geometry)
+        if len(coords) > 1
+    ]
+    if not parts:
+        return np.empty((0, 2)), np.empty(0)
+
+    starts = np.concatenate([coords[:-1] for coords in parts])
+    ends = np.concatenate([coords[1:] for coords in parts])
+    lengths = np.hypot(*(ends - starts).T)
+    n_steps = np.maximum(np.ceil(lengths / spacing), 1).astype(np.int64)
+
+    segment = np.repeat(np.arange(len(starts)), n_steps)
+    step = np.arange(n_steps.sum()) \
+        - np.repeat(n_steps.cumsum() - n_steps, n_steps)
+    fraction = (step / n_steps[segment])[:, None]
+    points = starts[segment] + fraction * (ends[segment] - starts[segment])
+
+    last_vertices = np.array([coords[-1] for coords in parts])
+    weights = np.concatenate(
+        [(lengths / n_steps)[segment], np.zeros(len(last_vertices))]
+    )
+    return np.concatenate([points, last_vertices]), weights
+
+
+class FacilityIndex:
+    """
+    Nearest-neighbour indexes (KD-trees) of the metro stops, the train
+    stations and the bike lanes, in a metric CRS, to compute distance
+    features for many points at once.
+
+    Bike lanes are indexed through points along them, `lane_spacing`
+    metres apart.
+
+    Example:
+    facilities = FacilityIndex.from_store()
+    facilities.features(lon, lat, k=3, radii=[500])
+    facilities.tag(bikemi_stalls)
+    """
+
+    def __init__(
+        self,
+        facilities: Dict[str, geopandas.GeoDataFrame],
+        crs: int = METRIC_CRS,
+        lane_spacing: float = LANE_SPACING
+    ):
+        self.crs = crs
+        self.lane_spacing = lane_spacing
+        self.to_metric = Transformer.from_crs(4326, crs, always_xy=True)
+        self.trees: Dict[str, cKDTree] = {}
+        # for the facilities indexed through points along lines, the
+        # metres of line each point stands for
+        self.lines: Dict[str, np.ndarray] = {}
+
+        for name, layer in facilities.items():
+            geometry = layer.geometry.to_crs(crs)
+            geometry = geometry[geometry.notna() & ~geometry.is_empty]
+            if (geometry.geom_type == "Point").all():
+                coordinates = np.column_stack([geometry.x, geometry.y])
+            else:
+                coordinates, self.lines[name] = \
+                    densify_lines(geometry, lane_spacing)
+            self.trees[name] = cKDTree(coordinates)
+
+    @classmethod
+    def from_store(
+        cls,
+        store: Optional[LayerStore] = None,
+        crs: int = METRIC_CRS,
+        lane_spacing: float = LANE_SPACING
+    ) -> "FacilityIndex":
+        """Indexes the layers of `FACILITY_LAYERS` from the layer store."""
+        load = get_layer if store is None else store.get
+        return cls(
+            {name: load(layer) for name, layer in FACILITY_LAYERS.items()},
+            crs, lane_spacing
+        )
+
+    def project(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """The (x, y) coordinates of lon/lat points in the metric CRS."""
+        return np.column_stack(self.to_metric.transform(
+            np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        ))
+
+    def features(
+        self,
+        lon: np.ndarray,
+        lat: np.ndarray,
+        k: int = 1,
+        radii: Sequence[float] = RADII,
+        n_jobs: int = 1
+    ) -> pd.DataFrame:
+        """
+        Distance features of lon/lat points (EPSG:4326).
+
+        Args:
+        lon, lat (np.ndarray): the points.
+
+        k (int, optional): the number of nearest facilities of each kind.
+
+        radii (list, optional): the radii (in metres) to count facilities
+        within.
+
+        n_jobs (int, optional): the threads of the KD-tree queries (-1 for
+        all the cores).
+
+        Returns:
+        [pd.DataFrame]: one row per point, with the distance (in metres) to
+        the nearest facility of each kind ("dist_metro", ...) and to the
+        2nd to k-th nearest ("dist_metro_2", ...); for each radius, the
+        number of stops and stations ("n_metro_500m") and the length of
+        bike lanes ("bike_lane_m_500m") within it.
+        """
+        points = self.project(lon, lat)
+        columns: Dict[str, np.ndarray] = {}
+
+        for name, tree in self.trees.items():
+            # points along the same lane are not distinct facilities
+            lanes = name in self.lines
+            if not lanes:
+                distances, _ = tree.query(points, k=k, workers=n_jobs)
+                distances = distances.reshape(len(points), k)
+                for rank in range(k):
+                    suffix = "" if rank == 0 else f"_{rank + 1}"
+                    columns[f"dist_{name}{suffix}"] = distances[:, rank]
+            else:
+                distances, _ = tree.query(points, k=1, workers=n_jobs)
+                columns[f"dist_{name}"] = distances
+
+            for radius in radii:
+                if not lanes:
+                    columns[f"n_{name}_{radius:g}m"] = tree.query_ball_point(
+                        points, radius, workers=n_jobs, return_length=True
+                    )
+                    continue
+                # the metres of line of the indexed points within the radius
+                neighbours = tree.query_ball_point(
+                    points, radius, workers=n_jobs
+                )
+                counts = np.fromiter(map(len, neighbours), dtype=np.int64,
+                                     count=len(points))
+                within = np.concatenate(
+                    [np.asarray(indices, dtype=np.int64)
+                     for indices in neighbours]
+                ) if len(points) else np.empty(0, dtype=np.int64)
+                columns[f"{name}_m_{radius:g}m"] = np.bincount(
+                    np.repeat(np.arange(len(points)), counts),
+                    weights=self.lines[name][within], minlength=len(points)
+                )
+
+        return pd.DataFrame(columns)
+
+    def tag(
+        self,
+        data: pd.DataFrame,
+        lon_col: str = "longitudine",
+        lat_col: str = "latitudine",
+        **kwargs: object
+    ) -> pd.DataFrame:
+        """
+        Adds the distance features to the rows of `data`: to the points of
+        its geometry if it is a GeoDataFrame, or to its coordinate columns
+        (e.g. the virtual stalls). `kwargs` go to `features()`.
+        """
+        if isinstance(data, geopandas.GeoDataFrame):
+            points = data.geometry.to_crs(4326)
+            lon, lat = points.x.to_numpy(), points.y.to_numpy()
+        else:
+            lon, lat = data[lon_col].to_numpy(), data[lat_col].to_numpy()
+        features = self.features(lon, lat, **kwargs) \
+            .set_axis(data.index, axis=0)
+        return data.join(features.drop(columns=data.columns, errors="ignore"))
@@ -0,0 +1,162 @@
+import json
+import os
+from pathlib import Path
+
+import geopandas
+import numpy as np
+import pyarrow.parquet as pq
+import pyproj
+
+# for type stubs
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+MILAN_DATA = Path(__file__).resolve().parents[2] / "data" / "milan"
+
+# where the converted layers are stored, unless `store_dir` is given
+STORE_DIR = Path(
+    os.environ.get("BIKEMI_CACHE_DIR", Path.home() / ".cache" / "bikemi")
+) / "layers"
+
+# the layers of data/milan, by name
+LAYERS: Dict[str, str] = {
+    "nil": "administrative-nil.geo.json",
+    "municipi": "administrative-municipi.geo.json",
+    "area_c": "administrative-area_c.geo.json",
+    "area_circonvallazione": "custom-area_circonvallazione.geo.json",
+    "bike_lanes": "transports-bike_lanes.geo.json",
+    "metro_stops": "transports-metro_stops.geo.json",
+    "train_stations": "transports-train_stations.geo.json",
+    "stalls": "bikemi-stalls.geo.json",
+}
+
+# geographic coordinates, and the web mercator of the basemaps
+CRS = (4326, 3857)
+
+# parsing the CRS stored in each file takes longer than reading the file
+_CRS_OBJECTS = {crs: pyproj.CRS.from_epsg(crs) for crs in CRS}
+
+# GeoDataFrame.sindex.query() takes arrays of geometries from 0.12
+_QUERY_TAKES_ARRAYS = \
+    tuple(int(part) for part in geopandas.__version__.split(".")[:2]) \
+    >= (0, 12)
+
+
+def bulk_query(
+    sindex: Any,
+    geometries: Any,
+    predicate: Optional[str] = None
+) -> np.ndarray:
+    """
+    Queries a spatial index with many geometries at once, as
+    `sindex.query_bulk()` (geopandas < 0.12) or `sindex.query()`.
+
+    Returns:
+    [np.ndarray]: a (2, n) array with the positions of the input geometries
+    and of the matching geometries of the index.
+    """
+    if _QUERY_TAKES_ARRAYS:
+        return sindex.query(geometries, predicate=predicate)
+    return sindex.query_bulk(geometries, predicate=predicate)
+
+
+def _read_layer(path: Path, crs: int) -> geopandas.GeoDataFrame:
+    # geopandas.read_parquet(), with the CRS known in advance
+    table = pq.read_table(path)
+    geometry = json.loads(table.schema.metadata[b"geo"])["primary_column"]
+    data = table.to_pandas()
+    data[geometry] = geopandas.GeoSeries.from_wkb(
+        data[geometry].to_numpy(), index=data.index, crs=_CRS_OBJECTS[crs]
+    )
+    return geopandas.GeoDataFrame(data, geometry=geometry)
+
+
+class LayerStore:
+    """
+    The layers of data/milan, converted once from GeoJSON to GeoParquet,
+    in EPSG:4326 and EPSG:3857.
+
+    A layer is read on first access and kept in memory, together with its
+    spatial index, built on the first query; a layer is converted again if
+    its GeoJSON is newer than the stored files. The frames are shared:
+    copy them before changing them in place.
+
+    Example:
+    store = LayerStore()
+    store.get("nil")
+    store.get("bike_lanes", crs=3857).plot(ax=ax)
+    store.sindex("nil").query(point, predicate="within")
+    """
+
+    def __init__(
+        self,
+        source_dir: Union[str, Path] = MILAN_DATA,
+        store_dir: Union[str, Path] = STORE_DIR,
+        layers: Optional[Dict[str, str]] = None
+    ):
+        self.source_dir = Path(source_dir)
+        self.store_dir = Path(store_dir)
+        self.layers = LAYERS if layers is None else layers
+        self._frames: Dict[Tuple[str, int], geopandas.GeoDataFrame] = {}
+
+    def __getitem__(self, name: str) -> geopandas.GeoDataFrame:
+        return self.get(name)
+
+    def path(self, name: str, crs: int = 4326) -> Path:
+        """The GeoParquet file of a layer in a CRS."""
+        return self.store_dir / f"{name}-{crs}.parquet"
+
+    def is_stale(self, name: str) -> bool:
+        """The layer was never converted, or its GeoJSON changed since."""
+        source_time = (self.source_dir / self.layers[name]).stat().st_mtime
+        return any(
+            not self.path(name, crs).exists()
+            or self.path(name, crs).stat().st_mtime < source_time
+            for crs in CRS
+        )
+
+    def convert(self, name: str) -> None:
+        """Reads the GeoJSON of a layer and stores it in each CRS."""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        layer = geopandas.read_file(self.source_dir / self.layers[name])
+        for crs in CRS:
+            path = self.path(name, crs)
+            temporary = path.with_suffix(".tmp")
+            layer.to_crs(crs).to_parquet(temporary)
+            os.replace(temporary, path)
+            self._frames.pop((name, crs), None)
+
+    def convert_all(self, names: Optional[Sequence[str]] = None) -> None:
+        """Converts the stale layers (or the given ones, anyway)."""
+        if names is None:
+            names = [name for name in self.layers if self.is_stale(name)]
+        for name in names:
+            self.convert(name)
+
+    def get(self, name: str, crs: int = 4326) -> geopandas.GeoDataFrame:
+        """A layer in EPSG:4326 or EPSG:3857, read on first access."""
+        if crs not in CRS:
+            raise ValueError(f"layers are stored in EPSG {CRS}, not {crs}")
+        if (name, crs) not in self._frames:
+            if self.is_stale(name):
+                self.convert(name)
+            self._frames[name, crs] = _read_layer(self.path(name, crs), crs)
+        return self._frames[name, crs]
+
+    def sindex(self, name: str, crs: int = 4326) -> Any:
+        """The spatial index of a layer, built once per session."""
+        return self.get(name, crs).sindex
+
+    def clear(self) -> None:
+        """Forgets the layers read so far (the files are kept)."""
+        self._frames.clear()
+
+
+_default_store: Optional[LayerStore] = None
+
+
+def get_layer(name: str, crs: int = 4326) -> geopandas.GeoDataFrame:
+    """A layer of data/milan, from the default store (see `LayerStore`)."""
+    global _default_store
+    if _default_store is None:
+        _default_store = LayerStore()
+    return _default_store.get(name, crs)
@@ -0,0 +1,224 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# for type stubs
+from typing import Any, Iterable, Optional, Sequence, Union
+
+HOURS_IN_WEEK = 168
+
+# one scan of the rentals: counts by origin, destination and hour of the
+# week of the pick-up (0 is Monday, from midnight to 1)
+OD_QUERY = """
+    SELECT
+        nome_stazione_prelievo AS origin,
+        nome_stazione_restituzione AS destination,
+        ((EXTRACT("isodow" FROM data_prelievo) - 1) * 24
+            + EXTRACT("hour" FROM data_prelievo))::smallint AS hour_of_week,
+        COUNT(*) AS counts
+    FROM bikemi_rentals_before_2019
+    GROUP BY 1, 2, 3;
+"""
+
+# Monday to Friday, from 7 to 10 and from 17 to 20 (both included)
+COMMUTING_DAYS = range(5)
+COMMUTING_HOURS = [*range(7, 11), *range(17, 21)]
+
+
+class ODTensor:
+    """
+    Rentals by origin, destination and hour of the week, as a sparse
+    (coordinate) tensor: the arrays `origin`, `destination` (positions in
+    `stations`), `hour_of_week` and `counts` hold the non-empty cells.
+
+    Built with one scan of the rentals, the tensor answers the top-k and
+    time window queries with a few numpy operations.
+
+    Example:
+    od = ODTensor.from_database(conn)
+    od.save("od.npz")
+    od.top_origins(10, days=COMMUTING_DAYS, hours=COMMUTING_HOURS)
+    """
+
+    def __init__(
+        self,
+        stations: np.ndarray,
+        origin: np.ndarray,
+        destination: np.ndarray,
+        hour_of_week: np.ndarray,
+        counts: np.ndarray
+    ):
+        self.stations = np.asarray(stations, dtype=object)
+        self.origin = np.asarray(origin, dtype=np.int32)
+        self.destination = np.asarray(destination, dtype=np.int32)
+        self.hour_of_week = np.asarray(hour_of_week, dtype=np.int16)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_counts(cls, counts: pd.DataFrame) -> "ODTensor":
+        """
+        From a long DataFrame with "origin", "destination", "hour_of_week"
+        and "counts" columns (repeated cells are summed).
+        """
+        stations, codes = np.unique(
+            np.concatenate([
+                counts["origin"].to_numpy(dtype=object),
+                counts["destination"].to_numpy(dtype=object)
+            ]).astype(str),
+            return_inverse=True
+        )
+        n_cells = len(counts)
+        origin, destination = codes[:n_cells], codes[n_cells:]
+        hour_of_week = counts["hour_of_week"].to_numpy(dtype=np.int64)
+
+        # sum repeated cells, e.g. from partial aggregates
+        cell = (origin * len(stations) + destination) * HOURS_IN_WEEK \
+            + hour_of_week
+        cells, positions = np.unique(cell, return_inverse=True)
+        totals = np.bincount(
+            positions, weights=counts["counts"].to_numpy(dtype=float)
+        ).astype(np.int64)
+
+        cells, hour_of_week = np.divmod(cells, HOURS_IN_WEEK)
+        origin, destination = np.divmod(cells, len(stations))
+
+        return cls(stations, origin, destination, hour_of_week, totals)
+
+    @classmethod
+    def from_database(cls, connection: Any) -> "ODTensor":
+        """Builds the tensor with a single GROUP BY over the rentals."""
+        return cls.from_counts(pd.read_sql(OD_QUERY, connection))
+
+    @classmethod
+    def from_rentals(
+        cls,
+        rentals: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        origin_col: str = "nome_stazione_prelievo",
+        destination_col: str = "nome_stazione_restituzione",
+        time_col: str = "data_prelievo"
+    ) -> "ODTensor":
+        """
+        Builds the tensor from trip-level rentals, either a DataFrame or
+        chunks of it (e.g. from `rentals_stream.iter_rentals()`).
+        """
+        chunks = [rentals] if isinstance(rentals, pd.DataFrame) else rentals
+
+        partials = []
+        for chunk in chunks:
+            timestamps = chunk[time_col].dt
+            partials.append(
+                pd.DataFrame({
+                    "origin": chunk[origin_col].astype(str).to_numpy(),
+                    "destination": chunk[destination_col].astype(str)
+                    .to_numpy(),
+                    "hour_of_week": timestamps.dayofweek.to_numpy() * 24
+                    + timestamps.hour.to_numpy(),
+                })
+                .groupby(["origin", "destination", "hour_of_week"])
+                .size().rename("counts").reset_index()
+            )
+
+        return cls.from_counts(pd.concat(partials, ignore_index=True))
+
+    def save(self, path: Union[str, Path]) -> None:
+        np.savez(
+            path, stations=self.stations.astype(str), origin=self.origin,
+            destination=self.destination, hour_of_week=self.hour_of_week,
+            counts=self.counts
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ODTensor":
+        with np.load(path) as arrays:
+            return cls(
+                arrays["stations"], arrays["origin"], arrays["destination"],
+                arrays["hour_of_week"], arrays["counts"]
+            )
+
+    def _window(
+        self,
+        days: Optional[Sequence[int]] = None,
+        hours: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        # the counts in the time window: days from 0 (Monday) to 6, hours
+        # from 0 to 23
+        selected = np.ones((7, 24), dtype=bool)
+        if days is not None:
+            selected[np.setdiff1d(np.arange(7), days)] = False
+        if hours is not None:
+            selected[:, np.setdiff1d(np.arange(24), hours)] = False
+        return np.where(selected.ravel()[self.hour_of_week], self.counts, 0)
+
+    def matrix(
+        self,
+        days: Optional[Sequence[int]] = None,
+        hours: Optional[Sequence[int]] = None
+    ) -> sparse.csr_matrix:
+        """The origin x destination matrix of the rentals in the window."""
+        n_stations = len(self.stations)
+        return sparse.csr_matrix(
+            (self._window(days, hours), (self.origin, self.destination)),
+            shape=(n_stations, n_stations)
+        )
+
+    @staticmethod
+    def _top(totals: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, len(totals))
+        top = np.argpartition(-totals, k - 1)[:k]
+        return top[np.argsort(-totals[top], kind="stable")]
+
+    def top_origins(
+        self,
+        k: int = 10,
+        days: Optional[Sequence[int]] = None,
+        hours: Optional[Sequence[int]] = None
+    ) -> pd.DataFrame:
+        """The `k` stations with the most departures in the window."""
+        totals = np.bincount(
+            self.origin, self._window(days, hours),
+            minlength=len(self.stations)
+        ).astype(np.int64)
+        top = self._top(totals, k)
+        return pd.DataFrame({
+            "stazione_prelievo": self.stations[top],
+            "numero_noleggi": totals[top],
+        })
+
+    def top_destinations(
+        self,
+        k: int = 10,
+        days: Optional[Sequence[int]] = None,
+        hours: Optional[Sequence[int]] = None
+    ) -> pd.DataFrame:
+        """The `k` stations with the most arrivals in the window."""
+        totals = np.bincount(
+            self.destination, self._window(days, hours),
+            minlength=len(self.stations)
+        ).astype(np.int64)
+        top = self._top(totals, k)
+        return pd.DataFrame({
+            "stazione_restituzione": self.stations[top],
+            "numero_noleggi": totals[top],
+        })
+
+    def top_od(
+        self,
+        k: int = 10,
+        days: Optional[Sequence[int]] = None,
+        hours: Optional[Sequence[int]] = None
+    ) -> pd.DataFrame:
+        """The `k` origin-destination pairs with the most rentals."""
+        n_stations = len(self.stations)
+        totals = np.bincount(
+            self.origin * n_stations + self.destination,
+            self._window(days, hours), minlength=n_stations ** 2
+        ).astype(np.int64)
+        top = self._top(totals, k)
+        origin, destination = np.divmod(top, n_stations)
+        return pd.DataFrame({
+            "stazione_prelievo": self.stations[origin],
+            "stazione_destinazione": self.stations[destination],
+            "numero_noleggi": totals[top],
+        })
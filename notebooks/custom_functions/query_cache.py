@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+# for type stubs
+from typing import Any, Optional, Sequence, Tuple
+
+# where query results are stored, unless `cache_dir` is given
+CACHE_DIR = Path(
+    os.environ.get("BIKEMI_CACHE_DIR", Path.home() / ".cache" / "bikemi")
+) / "queries"
+
+# the version of a relation is transactional state: its file node (which
+# REFRESH MATERIALIZED VIEW, TRUNCATE and VACUUM FULL change) and the
+# number of committed transactions that wrote to it, as recorded by the
+# triggers of data/queries/create_table-relation_writes.sql. The pg_stat
+# counters are added for the tables without triggers, but they are
+# asynchronous: flushed up to a second (or more) after the commit.
+# Plain views and partitioned tables are replaced by the relations they
+# read (through the rules of the views) or by their partitions,
+# recursively; the writes recorded on them count too
+TABLE_VERSIONS_QUERY = """
+    WITH RECURSIVE relations(oid, relkind) AS (
+        SELECT c.oid, c.relkind
+        FROM pg_class c
+        WHERE c.oid = ANY (%s::regclass[])
+        UNION
+        SELECT c.oid, c.relkind
+        FROM relations r
+                 LEFT JOIN pg_rewrite w
+                           ON r.relkind = 'v' AND w.ev_class = r.oid
+                 LEFT JOIN pg_depend d
+                           ON d.classid = 'pg_rewrite'::regclass
+                               AND d.objid = w.oid
+                               AND d.refclassid = 'pg_class'::regclass
+                               AND d.refobjid <> r.oid
+                 LEFT JOIN pg_inherits i ON i.inhparent = r.oid
+                 JOIN pg_class c ON c.oid = COALESCE(d.refobjid, i.inhrelid)
+    )
+    SELECT r.oid::regclass::text,
+           c.relfilenode,
+           COALESCE(w.writes, 0),
+           COALESCE(s.n_tup_ins, 0),
+           COALESCE(s.n_tup_upd, 0),
+           COALESCE(s.n_tup_del, 0)
+    FROM relations r
+             JOIN pg_class c ON c.oid = r.oid
+             LEFT JOIN ({writes}) w ON w.relation = r.oid
+             LEFT JOIN pg_stat_all_tables s ON s.relid = r.oid
+    WHERE r.relkind IN ('r', 'm', 'f')
+       OR w.writes IS NOT NULL
+    ORDER BY 1;
+"""
+
+RELATION_WRITES = "bikemi_rentals.relation_writes"
+
+WRITES_QUERY = f"""
+    SELECT relation::oid AS relation, COUNT(*) AS writes
+    FROM {RELATION_WRITES}
+    GROUP BY relation
+"""
+
+# without the table of the writes
+NO_WRITES_QUERY = "SELECT 0::oid AS relation, 0::bigint AS writes LIMIT 0"
+
+
+def normalize_query(query: str) -> str:
+    """Collapses whitespace and drops the final semicolon of a query."""
+    return " ".join(query.split()).rstrip(" ;")
+
+
+def table_versions(
+    connection: Any,
+    tables: Sequence[str]
+) -> Tuple[Tuple[Any, ...], ...]:
+    """
+    The version of each table (or materialized view) read by `tables`: its
+    file node, the number of transactions that wrote to it (see
+    `TABLE_VERSIONS_QUERY`) and the number of inserted, updated and
+    deleted rows. Views and partitioned tables stand for the tables they
+    read.
+
+    If the connection is idle, the query runs in a transaction of its own
+    (autocommit), so it sees the writes committed since the connection's
+    last transaction; within an open transaction, it sees the snapshot of
+    that transaction, like the cached query would.
+    """
+    idle = not connection.autocommit \
+        and connection.info.transaction_status == 0
+    if idle:
+        connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            # the pg_stat counters are otherwise read once per transaction
+            cursor.execute("SELECT pg_stat_clear_snapshot();")
+            cursor.execute(
+                "SELECT to_regclass(%s) IS NOT NULL;", (RELATION_WRITES,)
+            )
+            writes = WRITES_QUERY if cursor.fetchone()[0] \
+                else NO_WRITES_QUERY
+            cursor.execute(
+                TABLE_VERSIONS_QUERY.format(writes=writes), (list(tables),)
+            )
+            versions = tuple(tuple(row) for row in cursor.fetchall())
+    finally:
+        if idle:
+            connection.autocommit = False
+    # a key that never changes would serve stale results forever
+    if not versions:
+        raise ValueError(f"{list(tables)} read no table to version")
+    return versions
+
+
+def _digest(value: Any) -> str:
+    encoded = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def _write_table(data: pd.DataFrame, path: Path) -> None:
+    # uncompressed Arrow IPC, so that reads can map the file without copies
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    temporary = path.with_suffix(".tmp")
+    with pa.OSFile(str(temporary), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary, path)
+
+
+def _read_table(path: Path) -> pd.DataFrame:
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def read_sql_cached(
+    query: str,
+    connection: Any,
+    tables: Sequence[str],
+    params: Optional[Any] = None,
+    cache_dir: Optional[Path] = None,
+    **kwargs: Any
+) -> pd.DataFrame:
+    """
+    `pd.read_sql()` with a local cache of the results.
+
+    Results are stored as Arrow files, keyed by the normalised query, its
+    parameters, the `pd.read_sql()` arguments and the current version of
+    `tables`, and read back through a memory map. Refreshing a
+    materialized view (or writing to a table) changes its version, so the
+    next call runs the query again and replaces the stale file.
+
+    Writes are seen as soon as they commit on the tables with the triggers
+    of data/queries/create_table-relation_writes.sql. On the other tables
+    the cache relies on the pg_stat counters, which are updated
+    asynchronously: a result cached right after a write may be stale until
+    the counters move. `REFRESH MATERIALIZED VIEW CONCURRENTLY` keeps the
+    file node, so it is also only seen through the counters.
+
+    Args:
+    query (str): the SQL query.
+
+    connection: the psycopg2 connection.
+
+    tables (list): the tables, views or materialized views the query
+    reads. A plain view is versioned by the relations underneath it, a
+    partitioned table by its partitions.
+
+    params (optional): the query parameters, as for `pd.read_sql()`.
+
+    cache_dir (Path, optional): defaults to $BIKEMI_CACHE_DIR/queries
+    (~/.cache/bikemi/queries).
+
+    **kwargs: passed on to `pd.read_sql()`, e.g. `index_col`.
+    """
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    query_key = _digest([normalize_query(query), params, kwargs])
+    version_key = _digest(table_versions(connection, tables))
+    path = cache_dir / f"{query_key}-{version_key}.arrow"
+
+    if path.exists():
+        return _read_table(path)
+
+    data = pd.read_sql(query, connection, params=params, **kwargs)
+    _write_table(data, path)
+
+    # results computed on older versions of the tables are stale
+    for stale in cache_dir.glob(f"{query_key}-*.arrow"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+
+    return data
+
+
+def clear_query_cache(cache_dir: Optional[Path] = None) -> None:
+    """Deletes all the cached query results."""
+    for path in Path(cache_dir or CACHE_DIR).glob("*.arrow"):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,208 @@
+import os
+import threading
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# for type stubs
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+RENTALS_QUERY = "SELECT * FROM bikemi_rentals.bikemi_rentals_before_2019"
+
+# compact dtypes for the columns of the rentals; any other column is left to
+# the CSV parser. Station numbers fit in int16, station names repeat a lot
+RENTALS_DTYPES: Dict[str, str] = {
+    "tipo_bici": "category",
+    "numero_stazione_prelievo": "int16",
+    "nome_stazione_prelievo": "category",
+    "data_prelievo": "datetime64[ns]",
+    "numero_stazione_restituzione": "int16",
+    "nome_stazione_restituzione": "category",
+    "data_restituzione": "datetime64[ns]",
+    "durata_noleggio": "timedelta64[ns]",
+}
+
+CHUNK_SIZE = 500_000
+
+
+def _copy_to_pipe(
+    connection: Any,
+    query: str,
+    writer: Any,
+    errors: List[BaseException]
+) -> None:
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                writer
+            )
+    except BaseException as error:
+        errors.append(error)
+    finally:
+        writer.close()
+
+
+def _decode(chunk: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    # the CSV parser reads numbers and categories directly; timestamps and
+    # intervals (e.g. "00:12:34" or "1 day 02:00:00") are converted here
+    for col, dtype in dtypes.items():
+        if col not in chunk:
+            continue
+        if dtype.startswith("datetime64"):
+            chunk[col] = pd.to_datetime(chunk[col])
+        elif dtype.startswith("timedelta64"):
+            chunk[col] = pd.to_timedelta(chunk[col])
+    return chunk
+
+
+def iter_rentals(
+    connection: Any,
+    query: str = RENTALS_QUERY,
+    chunksize: int = CHUNK_SIZE,
+    dtypes: Optional[Dict[str, str]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams the result of a query as DataFrames of `chunksize` rows.
+
+    The server writes the rows with `COPY ... TO STDOUT` into a pipe,
+    which pandas' CSV parser reads a chunk at a time, so only one chunk
+    (plus the pipe buffer) is ever in memory, and values go straight into
+    compact dtypes instead of Python objects.
+
+    Args:
+    connection: the psycopg2 connection.
+
+    query (str, optional): the query, by default all the rentals before
+    2019.
+
+    chunksize (int, optional): the number of rows of each chunk.
+
+    dtypes (dict, optional): the dtype of each column, by default
+    `RENTALS_DTYPES`. Categories are computed chunk by chunk: use
+    `read_rentals()` to concatenate the chunks.
+    """
+    dtypes = RENTALS_DTYPES if dtypes is None else dtypes
+    parsed_dtypes = {
+        col: dtype for col, dtype in dtypes.items()
+        if not dtype.startswith(("datetime64", "timedelta64"))
+    }
+
+    read_fd, write_fd = os.pipe()
+    reader, writer = os.fdopen(read_fd, "rb"), os.fdopen(write_fd, "wb")
+    errors: List[BaseException] = []
+    copy = threading.Thread(
+        target=_copy_to_pipe, args=(connection, query, writer, errors),
+        daemon=True
+    )
+    copy.start()
+
+    finished = False
+    try:
+        for chunk in pd.read_csv(
+            reader, chunksize=chunksize, dtype=parsed_dtypes
+        ):
+            yield _decode(chunk, dtypes)
+        finished = True
+    finally:
+        if copy.is_alive():
+            # the caller stopped early: stop the server and the copy
+            connection.cancel()
+        reader.close()
+        copy.join()
+        if errors:
+            connection.rollback()
+            if finished:
+                raise errors[0]
+
+
+def read_rentals(
+    connection: Any,
+    query: str = RENTALS_QUERY,
+    chunksize: int = CHUNK_SIZE,
+    dtypes: Optional[Dict[str, str]] = None
+) -> pd.DataFrame:
+    """
+    Loads a query into a single DataFrame with compact dtypes, a chunk at
+    a time (see `iter_rentals()`); the categories of the chunks are merged.
+    """
+    chunks = list(iter_rentals(connection, query, chunksize, dtypes))
+    if not chunks:
+        return pd.DataFrame()
+
+    categorical = [
+        col for col, dtype in chunks[0].dtypes.items() if dtype == "category"
+    ]
+    merged = {
+        col: union_categoricals([chunk[col] for chunk in chunks])
+        for col in categorical
+    }
+    output = pd.concat(
+        [chunk.drop(columns=categorical) for chunk in chunks],
+        ignore_index=True
+    )
+    for col, values in merged.items():
+        output[col] = values
+
+    return output[chunks[0].columns]
+
+
+def aggregate_rentals(
+    chunks: Iterable[pd.DataFrame],
+    by: Sequence[str],
+    freq: Optional[str] = None,
+    time_col: str = "data_prelievo",
+    values: Sequence[str] = ()
+) -> pd.DataFrame:
+    """
+    Counts rentals by `by` (and by time bucket) out of core: each chunk is
+    aggregated as it arrives and only the running totals are kept.
+
+    Args:
+    chunks (iterable): the chunks, e.g. from `iter_rentals()`.
+
+    by (list): the grouping columns, e.g. ["numero_stazione_prelievo"].
+
+    freq (str, optional): also group by `time_col` rounded down to this
+    frequency, e.g. "D" or "h".
+
+    time_col (str, optional): the timestamp to bucket.
+
+    values (list, optional): numeric or timedelta columns to average,
+    e.g. ["durata_noleggio"].
+
+    Returns:
+    [pd.DataFrame]: the number of rentals ("noleggi") and the mean of each
+    of `values` ("<value>_mean"), by group.
+    """
+    totals: Optional[pd.DataFrame] = None
+    durations = set()
+    for chunk in chunks:
+        keys = [chunk[col] for col in by]
+        if freq is not None:
+            keys.append(chunk[time_col].dt.floor(freq))
+
+        # timedeltas are summed as seconds
+        sums = pd.DataFrame(index=chunk.index)
+        for value in values:
+            if chunk[value].dtype.kind == "m":
+                durations.add(value)
+                sums[value] = chunk[value].dt.total_seconds()
+            else:
+                sums[value] = chunk[value]
+
+        partial = sums.assign(noleggi=1) \
+            .groupby(keys, observed=True, sort=False).sum()
+        totals = partial if totals is None \
+            else totals.add(partial, fill_value=0)
+
+    if totals is None:
+        return pd.DataFrame(columns=["noleggi"])
+
+    output = totals.sort_index().astype({"noleggi": "int64"})
+    for value in values:
+        mean = output.pop(value) / output["noleggi"]
+        output[f"{value}_mean"] = pd.to_timedelta(mean, unit="s") \
+            if value in durations else mean
+
+    return output
@@ -0,0 +1,320 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# for type stubs
+from typing import (
+    Any, List, NamedTuple, Optional, Sequence, Tuple, Union
+)
+
+COUNTS_FILE = "counts.npy"
+METADATA_FILE = "metadata.json"
+
+COUNTS_DTYPE = np.int16
+
+# stations profiled at once by `profile_missing_obs()`
+STATION_CHUNK = 64
+
+# the levels of "null_obs_ranking", in ascending order
+NULL_OBS_LABELS = ["very_low", "low", "average", "high", "very_high"]
+
+
+class RentalsTensor:
+    """
+    Rentals counts as a dense stations x timestamps array of int16, with
+    the station names and the time index alongside.
+
+    Each station's series is contiguous, so selecting stations or a time
+    range is a numpy view, not a copy. Saved as a .npy file plus a JSON
+    file with the names and timestamps, the tensor is memory-mapped on
+    load: only the slices actually read are paged in.
+
+    Example:
+    tensor = RentalsTensor.from_long(daily_rentals)
+    tensor.save("daily_rentals")
+    tensor = RentalsTensor.load("daily_rentals")
+    tensor.sel(start="2016-01-01", end="2016-12-31").to_frame()
+    """
+
+    def __init__(
+        self,
+        counts: np.ndarray,
+        stations: Sequence[str],
+        time: Union[pd.DatetimeIndex, Sequence[Any]],
+        value_name: str = "noleggi"
+    ):
+        self.counts = counts
+        self.stations = pd.Index(stations, name="stazione_partenza")
+        self.time = pd.DatetimeIndex(time, name="data_partenza")
+        self.value_name = value_name
+
+        if counts.shape != (len(self.stations), len(self.time)):
+            raise ValueError(
+                f"counts of shape {counts.shape} do not match "
+                f"{len(self.stations)} stations and {len(self.time)} "
+                "timestamps"
+            )
+
+    def __repr__(self) -> str:
+        return (
+            f"RentalsTensor({self.value_name}: {len(self.stations)} "
+            f"stations x {len(self.time)} timestamps)"
+        )
+
+    @property
+    def shape(self) -> tuple:
+        return self.counts.shape
+
+    @classmethod
+    def from_long(
+        cls,
+        data: pd.DataFrame,
+        station_col: str = "stazione_partenza",
+        value_col: Optional[str] = None,
+        time_col: Optional[str] = None
+    ) -> "RentalsTensor":
+        """
+        From the long layout of the rentals views (one row per station and
+        timestamp, as returned by `retrieve_daily_rentals`), without
+        pivoting: each row is written straight to its cell. Missing cells
+        are 0 and repeated cells are summed.
+
+        Args:
+        data (pd.DataFrame): the long data.
+
+        station_col (str, optional): the station names.
+
+        value_col (str, optional): the counts, by default the column
+        starting with "noleggi".
+
+        time_col (str, optional): the timestamps, by default the index.
+        """
+        if value_col is None:
+            value_col = next(
+                col for col in data.columns if col.startswith("noleggi")
+            )
+        times = data.index if time_col is None else data[time_col]
+
+        station_codes, stations = pd.factorize(data[station_col], sort=True)
+        time_codes, time = pd.factorize(pd.DatetimeIndex(times), sort=True)
+
+        cells = station_codes.astype(np.int64) * len(time) + time_codes
+        totals = np.bincount(
+            cells, weights=data[value_col].to_numpy(dtype=float),
+            minlength=len(stations) * len(time)
+        )
+        if totals.max(initial=0) > np.iinfo(COUNTS_DTYPE).max:
+            raise ValueError(f"{value_col} does not fit in {COUNTS_DTYPE}")
+
+        counts = totals.astype(COUNTS_DTYPE) \
+            .reshape(len(stations), len(time))
+        return cls(counts, stations, time, value_col)
+
+    def save(self, directory: Union[str, Path]) -> None:
+        """Writes counts.npy and metadata.json into `directory`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / COUNTS_FILE, np.ascontiguousarray(self.counts))
+        metadata = {
+            "value_name": self.value_name,
+            "stations": self.stations.astype(str).tolist(),
+            "time": self.time.strftime("%Y-%m-%dT%H:%M:%S").tolist(),
+        }
+        with open(directory / METADATA_FILE, "w") as file:
+            json.dump(metadata, file)
+
+    @classmethod
+    def load(
+        cls,
+        directory: Union[str, Path],
+        mmap_mode: Optional[str] = "r"
+    ) -> "RentalsTensor":
+        """
+        Opens a saved tensor; the counts are memory-mapped (read only) unless
+        `mmap_mode` is None.
+        """
+        directory = Path(directory)
+        with open(directory / METADATA_FILE) as file:
+            metadata = json.load(file)
+        counts = np.load(directory / COUNTS_FILE, mmap_mode=mmap_mode)
+        return cls(
+            counts, metadata["stations"], metadata["time"],
+            metadata["value_name"]
+        )
+
+    def sel(
+        self,
+        stations: Optional[Union[str, Sequence[str], slice]] = None,
+        start: Optional[Any] = None,
+        end: Optional[Any] = None
+    ) -> "RentalsTensor":
+        """
+        Selects stations and a time range (both ends included).
+
+        A single station or a slice of station names gives a view of the
+        counts; a list of stations copies them.
+        """
+        first, last = self.time.slice_locs(start, end)
+        time_slice = slice(first, last)
+
+        if stations is None:
+            rows: Any = slice(None)
+        elif isinstance(stations, str):
+            position = self.stations.get_loc(stations)
+            rows = slice(position, position + 1)
+        elif isinstance(stations, slice):
+            rows = slice(
+                *self.stations.slice_locs(stations.start, stations.stop)
+            )
+        else:
+            rows = self.stations.get_indexer(stations)
+            if (rows < 0).any():
+                missing = np.asarray(stations)[rows < 0]
+                raise KeyError(f"unknown stations: {list(missing)}")
+
+        return RentalsTensor(
+            self.counts[rows, time_slice], self.stations[rows],
+            self.time[time_slice], self.value_name
+        )
+
+    def series(self, station: str) -> pd.Series:
+        """The counts of one station, as a Series over a view."""
+        return pd.Series(
+            self.counts[self.stations.get_loc(station)], index=self.time,
+            name=station, copy=False
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The wide DataFrame (timestamps x stations), as from `long_to_wide()`,
+        on a transposed view of the counts.
+        """
+        return pd.DataFrame(
+            self.counts.T, index=self.time, columns=self.stations, copy=False
+        )
+
+    def to_long(self) -> pd.DataFrame:
+        """The long layout, as from the rentals views."""
+        n_stations, n_times = self.counts.shape
+        return pd.DataFrame(
+            {
+                self.stations.name: np.repeat(self.stations, n_times),
+                self.value_name: np.asarray(self.counts).ravel(),
+            },
+            index=pd.DatetimeIndex(
+                np.tile(self.time, n_stations), name=self.time.name
+            )
+        )
+
+
+class MissingObsProfile(NamedTuple):
+    stations: pd.DataFrame
+    outages: pd.DataFrame
+
+
+def _zero_runs(zero: np.ndarray) -> Tuple[np.ndarray, ...]:
+    # the runs of True along the rows: row, first and past-the-end column
+    padded = np.zeros((zero.shape[0], zero.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = zero
+    steps = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    return rows, starts, ends
+
+
+def profile_missing_obs(
+    tensor: RentalsTensor,
+    min_outage: int = 1,
+    chunk_size: int = STATION_CHUNK
+) -> MissingObsProfile:
+    """
+    Profiles the observations without rentals ("null" observations) of
+    every station, `chunk_size` stations at a time, so that the memory
+    used does not grow with the number of stations (a memory-mapped
+    tensor is only read one chunk at a time).
+
+    Args:
+    tensor (RentalsTensor): the daily or hourly counts.
+
+    min_outage (int, optional): the shortest run of null observations
+    reported as an outage.
+
+    chunk_size (int, optional): the number of stations profiled at once.
+
+    Returns:
+    [MissingObsProfile]: `stations`, by station, with the number and share
+    of null observations ("null_obs", "pct_null", "null_obs_ranking" as in
+    chapter 3), the longest run of them ("longest_gap"), the first and
+    last observation with rentals and the number of outages; `outages`,
+    one row per outage, with its first and last observation and length.
+    Lengths are in observations, i.e. days or (service) hours.
+    """
+    n_stations, n_times = tensor.shape
+    null_obs = np.zeros(n_stations, dtype=np.int64)
+    longest_gap = np.zeros(n_stations, dtype=np.int64)
+    n_outages = np.zeros(n_stations, dtype=np.int64)
+    first_active = np.full(n_stations, -1, dtype=np.int64)
+    last_active = np.full(n_stations, -1, dtype=np.int64)
+    outages: List[Tuple[np.ndarray, ...]] = []
+
+    for first in range(0, n_stations, chunk_size):
+        rows = slice(first, min(first + chunk_size, n_stations))
+        zero = np.asarray(tensor.counts[rows]) == 0
+        active = ~zero
+
+        null_obs[rows] = zero.sum(axis=1)
+        has_rentals = active.any(axis=1)
+        first_active[rows] = np.where(
+            has_rentals, active.argmax(axis=1), -1
+        )
+        last_active[rows] = np.where(
+            has_rentals, n_times - 1 - active[:, ::-1].argmax(axis=1), -1
+        )
+
+        run_rows, starts, ends = _zero_runs(zero)
+        lengths = ends - starts
+        np.maximum.at(longest_gap[rows], run_rows, lengths)
+
+        is_outage = lengths >= min_outage
+        run_rows = run_rows[is_outage] + first
+        np.add.at(n_outages, run_rows, 1)
+        outages.append(
+            (run_rows, starts[is_outage], ends[is_outage] - 1,
+             lengths[is_outage])
+        )
+
+    def timestamps(positions: np.ndarray) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(
+            np.where(positions < 0, np.datetime64("NaT"),
+                     tensor.time.to_numpy()[positions])
+        )
+
+    stations = pd.DataFrame(
+        {
+            "null_obs": null_obs,
+            "pct_null": null_obs / n_times,
+            "longest_gap": longest_gap,
+            "first_active": timestamps(first_active),
+            "last_active": timestamps(last_active),
+            "n_outages": n_outages,
+        },
+        index=tensor.stations
+    ).sort_values("null_obs", ascending=False, kind="stable")
+    stations.insert(
+        2, "null_obs_ranking",
+        pd.cut(stations["pct_null"], bins=5, labels=NULL_OBS_LABELS)
+    )
+
+    run_rows, starts, ends, lengths = (
+        np.concatenate(values) for values in zip(*outages)
+    ) if outages else (np.array([], dtype=np.int64),) * 4
+    outages_frame = pd.DataFrame({
+        tensor.stations.name: tensor.stations[run_rows],
+        "start": tensor.time[starts],
+        "end": tensor.time[ends],
+        "length": lengths,
+    })
+
+    return MissingObsProfile(stations, outages_frame)
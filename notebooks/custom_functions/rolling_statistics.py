@@ -0,0 +1,305 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# for type stubs
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+STATISTICS = ("mean", "std", "min", "max")
+
+# upper bound on the elements of the (time x series) blocks processed at once
+CHUNK_ELEMENTS = 2_000_000
+
+
+def _block_moments(
+    blocks: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+           np.ndarray]:
+    """
+    Count, mean and sum of squared deviations (M2) of every prefix and
+    every suffix of each block, for blocks shaped (blocks, window, series).
+
+    Values are shifted by the block mean before accumulating, so that
+    the sums never grow beyond the scale of a single window.
+    """
+    valid = ~np.isnan(blocks)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = valid.sum(axis=1, keepdims=True)
+        shift = np.where(valid, blocks, 0).sum(axis=1, keepdims=True) / count
+    shift = np.nan_to_num(shift)
+
+    deviations = np.where(valid, blocks - shift, 0.0)
+
+    def moments(
+        sum_of_valid: np.ndarray,
+        sum_of_deviations: np.ndarray,
+        sum_of_squares: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        mean_deviation = np.divide(
+            sum_of_deviations, sum_of_valid,
+            out=np.zeros_like(sum_of_deviations), where=sum_of_valid > 0
+        )
+        m2 = np.maximum(
+            sum_of_squares - mean_deviation * sum_of_deviations, 0.0
+        )
+        return sum_of_valid, shift + mean_deviation, m2
+
+    prefix = moments(
+        valid.cumsum(axis=1, dtype=float),
+        deviations.cumsum(axis=1),
+        (deviations ** 2).cumsum(axis=1)
+    )
+
+    # suffixes are prefixes of the reversed blocks
+    suffix = moments(
+        valid[:, ::-1].cumsum(axis=1, dtype=float)[:, ::-1],
+        deviations[:, ::-1].cumsum(axis=1)[:, ::-1],
+        (deviations ** 2)[:, ::-1].cumsum(axis=1)[:, ::-1]
+    )
+
+    return prefix + suffix
+
+
+def _merge_moments(
+    count_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray,
+    count_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Chan et al. pairwise update of Welford's (count, mean, M2)."""
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    share_b = np.divide(
+        count_b, count, out=np.zeros_like(count), where=count > 0
+    )
+    mean = mean_a + delta * share_b
+    m2 = m2_a + m2_b + delta ** 2 * count_a * share_b
+    return count, mean, m2
+
+
+def _window_extrema(
+    blocks: np.ndarray,
+    previous: Callable[[np.ndarray], np.ndarray],
+    accumulate: np.ufunc
+) -> np.ndarray:
+    """
+    Sliding minimum or maximum (van Herk/Gil-Werman): the extremum over
+    a window is the one of the suffix of the previous block and the prefix
+    of the current one. NaNs are ignored, as `np.fmin`/`np.fmax` do.
+    """
+    prefix = accumulate.accumulate(blocks, axis=1)
+    suffix = accumulate.accumulate(blocks[:, ::-1], axis=1)[:, ::-1]
+    return accumulate(previous(suffix), prefix)
+
+
+def _rolling_array(
+    values: np.ndarray,
+    window: int,
+    statistics: Sequence[str],
+    quantiles: Sequence[float],
+    min_periods: int
+) -> Dict[str, np.ndarray]:
+    """Rolling statistics of a 2-D (time x series) float array."""
+    n_obs, n_series = values.shape
+    if n_obs == 0:
+        names = [name for name in STATISTICS if name in statistics] \
+            + [f"quantile_{quantile:g}" for quantile in quantiles]
+        return {name: np.empty((0, n_series)) for name in names}
+
+    n_blocks = -(-n_obs // window)
+
+    # pad the end with missing values so that blocks have the same length
+    padded = np.full((n_blocks * window, n_series), np.nan)
+    padded[:n_obs] = values
+    blocks = padded.reshape(n_blocks, window, n_series)
+
+    def previous(by_block: np.ndarray, empty: float = np.nan) -> np.ndarray:
+        # the part of the window in block b - 1 starts right after position
+        # j, so it is the suffix beginning at j + 1 (empty when j is last)
+        shifted = np.empty_like(by_block)
+        shifted[0] = empty
+        shifted[1:, :-1] = by_block[:-1, 1:]
+        shifted[1:, -1] = empty
+        return shifted
+
+    (prefix_count, prefix_mean, prefix_m2,
+     suffix_count, suffix_mean, suffix_m2) = _block_moments(blocks)
+
+    def unblock(by_block: np.ndarray) -> np.ndarray:
+        return by_block.reshape(-1, n_series)[:n_obs]
+
+    count, mean, m2 = _merge_moments(
+        previous(suffix_count, 0), previous(suffix_mean, 0),
+        previous(suffix_m2, 0), prefix_count, prefix_mean, prefix_m2
+    )
+    count = unblock(count)
+    enough = count >= max(min_periods, 1)
+
+    output = {}
+
+    if "mean" in statistics:
+        output["mean"] = np.where(enough, unblock(mean), np.nan)
+
+    if "std" in statistics:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = unblock(m2) / (count - 1)
+        output["std"] = np.where(enough & (count > 1), np.sqrt(variance),
+                                 np.nan)
+
+    if "min" in statistics:
+        output["min"] = np.where(
+            enough, unblock(_window_extrema(blocks, previous, np.fmin)),
+            np.nan
+        )
+
+    if "max" in statistics:
+        output["max"] = np.where(
+            enough, unblock(_window_extrema(blocks, previous, np.fmax)),
+            np.nan
+        )
+
+    if len(quantiles):
+        # no linear-time algorithm here: sort each window. The windows are
+        # a view, but np.nanquantile() copies them (window values per
+        # observation), so they are sorted a batch of rows at a time.
+        # Leading missing values make room for the first, partial windows
+        leading = np.full((window - 1, n_series), np.nan)
+        windows = np.lib.stride_tricks.sliding_window_view(
+            np.vstack([leading, values]), window, axis=0
+        )
+        by_window = np.empty((len(quantiles), n_obs, n_series))
+        rows = max(1, CHUNK_ELEMENTS // (window * n_series))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for first in range(0, n_obs, rows):
+                batch = windows[first:first + rows]
+                # np.nanquantile() goes window by window: only when needed
+                by_batch = np.nanquantile if np.isnan(batch).any() \
+                    else np.quantile
+                by_window[:, first:first + rows] = \
+                    by_batch(batch, quantiles, axis=-1)
+        for quantile, result in zip(quantiles, by_window):
+            output[f"quantile_{quantile:g}"] = np.where(enough, result, np.nan)
+
+    return output
+
+
+def rolling_statistics(
+    data: Union[pd.Series, pd.DataFrame],
+    window: int,
+    statistics: Sequence[str] = ("mean", "std"),
+    quantiles: Sequence[float] = (),
+    min_periods: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Computes several rolling statistics of one or many time series at once.
+
+    Moments are accumulated block by block (blocks as long as the window)
+    and merged with Chan's pairwise version of Welford's algorithm,
+    so mean and standard deviation come out of the same pass and stay
+    accurate however long the series is. Rolling minima and maxima use
+    the same blocks. Missing values are skipped, as pandas does.
+
+    Args:
+    data (pd.Series or pd.DataFrame): the series (a wide DataFrame holds
+    one series per column, e.g. one per station).
+
+    window (int): the number of observations in each window.
+
+    statistics (list, optional): any of "mean", "std", "min", "max".
+
+    quantiles (list, optional): quantiles to compute, e.g. [0.1, 0.9].
+
+    min_periods (int, optional): the minimum number of observations in the
+    window to output a value. Defaults to `window`, as `pd.rolling()`.
+
+    Returns:
+    [pd.DataFrame]: one column per statistic (named as in `statistics` or
+    "quantile_<q>") for a Series; for a DataFrame, the columns are a
+    MultiIndex of (statistic, original column).
+    """
+    unknown = set(statistics) - set(STATISTICS)
+    if unknown:
+        raise ValueError(f"Unknown rolling statistics: {sorted(unknown)}")
+    if window < 1:
+        raise ValueError("The window must contain at least one observation")
+
+    min_periods = window if min_periods is None else min_periods
+
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    values = frame.to_numpy(dtype=float)
+
+    # process the series in chunks, to bound the memory footprint
+    step = max(1, CHUNK_ELEMENTS // max(len(values) + window, 1))
+    results: Dict[str, list] = {}
+    for first in range(0, values.shape[1], step):
+        chunk = _rolling_array(
+            values[:, first:first + step], window, statistics, quantiles,
+            min_periods
+        )
+        for name, result in chunk.items():
+            results.setdefault(name, []).append(result)
+
+    output = pd.concat(
+        {
+            name: pd.DataFrame(
+                np.hstack(chunks), index=frame.index, columns=frame.columns
+            )
+            for name, chunks in results.items()
+        },
+        axis=1
+    )
+
+    if isinstance(data, pd.Series):
+        output = output.droplevel(1, axis=1)
+
+    return output
+
+
+class RollingStatistics:
+    """
+    Rolling statistics that can be updated as new observations arrive.
+
+    The state is the tail of the last `window - 1` observations: each
+    `update()` only processes the tail and the new observations, and returns
+    the statistics of the new ones - the same values `rolling_statistics`
+    would return on the whole history.
+
+    Example:
+    monitor = RollingStatistics(window=24, statistics=["mean", "max"])
+    monitor.update(hourly_rentals_by_station)   # the whole history
+    monitor.update(last_hour_rentals)           # one new row
+    """
+
+    def __init__(
+        self,
+        window: int,
+        statistics: Sequence[str] = ("mean", "std"),
+        quantiles: Sequence[float] = (),
+        min_periods: Optional[int] = None
+    ):
+        self.window = window
+        self.statistics = statistics
+        self.quantiles = quantiles
+        self.min_periods = min_periods
+        self.tail: Optional[Union[pd.Series, pd.DataFrame]] = None
+
+    def update(
+        self,
+        new_data: Union[pd.Series, pd.DataFrame]
+    ) -> pd.DataFrame:
+        """Adds new observations and returns their rolling statistics."""
+        if self.tail is None:
+            data, n_old = new_data, 0
+        else:
+            data, n_old = pd.concat([self.tail, new_data]), len(self.tail)
+
+        statistics = rolling_statistics(
+            data, self.window, self.statistics, self.quantiles,
+            self.min_periods
+        )
+
+        self.tail = data.iloc[len(data) - (self.window - 1):] \
+            if self.window > 1 else data.iloc[:0]
+
+        return statistics.iloc[n_old:]
@@ -1,5 +1,4 @@
 import pandas as pd
-import holidays
 
 # for type stubs
 from typing import Optional, List, Dict, Union
@@ -9,25 +8,29 @@ import matplotlib.pyplot as plt
 import plotly.express as px
 import custom_functions.plot_styles as ps
 
+from custom_functions.calendar_features import cached_calendar_features
+from custom_functions.rolling_statistics import rolling_statistics
+from custom_functions.downsampling import MAX_POINTS, downsample
+
 
 def milan_holidays(ts: pd.DataFrame) -> pd.Series:
-    """Requires a DataFrame with a DateTimeIndex"""
-    ita_holidays = holidays.CountryHoliday(
-        "IT",
-        prov="MI",
-        years=[year for year in list(ts.index.year.unique())]
-    )
+    """
+    Requires a DataFrame with a DateTimeIndex.
 
-    # you cannot use `.apply()` on Indexes, but you
-    # can cast an Index as a Series!
-    return pd.DataFrame(ts.index, index=ts.index).iloc[:, 0] \
-        .apply(lambda x: ita_holidays.get(str(x)))\
-        .fillna("None").astype("category")
+    Returns a categorical Series with the name of the holiday (or "None")
+    of each timestamp, looked up in a cached holidays table
+    (see `calendar_features.holiday_calendar`). Results are memoised
+    by index, so repeated calls on the same date range are free.
+    """
+    return cached_calendar_features(
+        ts.index, ["holidays"], country="IT", prov="MI"
+    )["holiday"]
 
 
 def create_ts_features(
     dataframe: pd.DataFrame,
-    features: List[str] = ["day", "month"]
+    features: List[str] = ["day", "month"],
+    inplace: bool = True
 ) -> pd.DataFrame:
     """
         Generates time-series features out of a dataframe.
@@ -39,10 +42,10 @@ def create_ts_features(
 
         features (list, optional):
             The number of features to extract.
-            Defaults to ["day", "month", "year"].
+            Defaults to ["day", "month"].
             Possible values:
-            ["hour", "day", "month", "is_weekend", "week",
-            "year", "day_name", "month_name", "holidays"]
+            ["hour", "day", "day_names", "weekday", "weekends", "week",
+            "month", "month_name", "year", "holidays"]
 
             One note: week numbers depend on the year.
             Sometimes the last days of one year may actually be part
@@ -50,41 +53,30 @@ def create_ts_features(
             (this can help to spot the overlapping days:
             `dataframe.index.isocalendar().week.reset_index().groupby("week").size()`)
 
-        Returns the same dataframe, but with new columns
-    """
-    # this can also work:
-    # df['month'] = [d.strftime('%b') for d in df.Fu]
+        inplace (bool, optional):
+            Whether to add the columns to `dataframe` (the default)
+            or to return a new dataframe, without copying the source data.
 
-    if "hour" in features:
-        dataframe["hour"] = dataframe.index.hour.astype("category")
+        Returns the dataframe with the new columns.
+        The features are computed in one pass by
+        `calendar_features.calendar_features`, as compact categoricals,
+        and memoised by index (`calendar_features.cached_calendar_features`):
+        the new columns are read-only views on the cache, `.copy()` them
+        before modifying them in place.
+    """
+    ts_features = cached_calendar_features(dataframe.index, features)
 
     if "day" in features:
-        dataframe["day"] = (dataframe.index.day.astype("int") + 1) \
-            .astype("category")
-
-    if "day_names" in features:
-        dataframe["day_name"] = dataframe.index.day_name().astype("category")
-
-    if "weekends" in features:
-        dataframe["is_weekend"] = dataframe.index.isocalendar().day \
-            .apply(lambda x: 1 if x in [6, 7] else 0).astype("category")
-
-    if "week" in features:
-        dataframe["week"] = dataframe.index.isocalendar() \
-            .week.astype("category")
-
-    if "month" in features:
-        dataframe["month"] = dataframe.index.month.astype("category")
+        # the day of the month is shifted by one, as it has always been:
+        # keep it so that the models fitted so far see the same levels
+        ts_features["day"] = ts_features["day"].cat \
+            .rename_categories(lambda day: day + 1)
 
-    if "month_name" in features:
-        dataframe["month_name"] = dataframe.index.month_name() \
-            .astype("category")
+    if not inplace:
+        return pd.concat([dataframe, ts_features], axis=1)
 
-    if "year" in features:
-        dataframe["year"] = dataframe.index.year.astype("category")
-
-    if "holidays" in features:
-        dataframe["holiday"] = milan_holidays(dataframe).astype("category")
+    for col in ts_features.columns:
+        dataframe[col] = ts_features[col]
 
     return dataframe
 
@@ -105,14 +97,26 @@ def px_rolling_statistics(
         lags: int,
         statistics: List[str] = ["mean"],
         legend_args: Dict[str, Union[int, float, str]
-                          ] = px_default_legend_dict()
+                          ] = px_default_legend_dict(),
+        rolling: Optional[pd.DataFrame] = None,
+        max_points: Optional[int] = MAX_POINTS
 ) -> None:
     """
     Plots the rolling statistics of a time series using Plotly
 
     Takes as input a pd.DataFrame with a DateTimeIndex.
-
+    The rolling statistics are computed in one pass with
+    `rolling_statistics.rolling_statistics`, unless they are passed
+    (already computed, with the same window) as `rolling`.
+
+    Series longer than `max_points` are downsampled (LTTB, see
+    `downsampling.downsample`) before building the figure, which then
+    holds at most `max_points` points per trace: pass `max_points=None`
+    to plot every observation.
     """
+    if rolling is None:
+        rolling = rolling_statistics(ts[col], lags, statistics)
+
     title = "BikeMi Daily Rentals - Rolling "
     series_name = ["observed_values"]
     cols_to_plot = [ts[col]]
@@ -120,19 +124,23 @@ def px_rolling_statistics(
     if "mean" in statistics:
         title += "Mean "
         series_name.append("rolling mean")
-        cols_to_plot.append(ts[col].rolling(lags).mean())
+        cols_to_plot.append(rolling["mean"])
 
     if "std" in statistics:
         title += "Standard Deviation "
         series_name.append("rolling stdev")
-        cols_to_plot.append(ts[col].rolling(lags).std())
+        cols_to_plot.append(rolling["std"])
 
     title += f"(Window Size: {lags})"
 
+    to_plot = pd.concat(cols_to_plot, axis=1)
+    if max_points is not None:
+        to_plot = downsample(to_plot, max_points)
+
     rolling = px.line(
-        ts,
-        x=ts.index,
-        y=[col for col in cols_to_plot],
+        to_plot,
+        x=to_plot.index,
+        y=list(to_plot.columns),
         labels={"count": "Rentals ", "giorno_partenza": "Date ", "value": ""},
         color_discrete_sequence=px.colors.qualitative.T10,
         title=title
@@ -148,8 +156,20 @@ def px_rolling_statistics(
 def plt_rolling_statistics(
         ts: pd.Series,
         lags: int,
-        statistics: List[str] = ["mean"]) -> None:
-    """Plots the rolling statistics of a time series using Matplotlib"""
+        statistics: List[str] = ["mean"],
+        rolling: Optional[pd.DataFrame] = None,
+        max_points: Optional[int] = MAX_POINTS) -> None:
+    """
+    Plots the rolling statistics of a time series using Matplotlib.
+    The rolling statistics can be passed (already computed) as `rolling`.
+    Series longer than `max_points` are downsampled before plotting.
+    """
+    if rolling is None:
+        rolling = rolling_statistics(ts, lags, statistics)
+
+    if max_points is not None:
+        ts = downsample(ts, max_points)
+        rolling = downsample(rolling, max_points)
 
     fig, ax = plt.subplots()
 
@@ -157,12 +177,12 @@ def plt_rolling_statistics(
     ax.plot(ts, color="tab:blue", label="Observed Values")  # actual series
 
     if "mean" in statistics:  # if specified, plot rolling mean
-        ax.plot(ts.rolling(lags).mean(),
+        ax.plot(rolling["mean"],
                 color="tab:red",
                 label="Rolling Mean")
 
     if "std" in statistics:  # if specified, plot rolling standard deviation
-        ax.plot(ts.rolling(lags).std(),
+        ax.plot(rolling["std"],
                 color="tab:gray",
                 label="Rolling Standard Deviation")
 
@@ -1,9 +1,24 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+# for type stubs
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, \
+    Union
+
 # time series
 import statsmodels.tsa.api as tsa
-from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
+from scipy.stats import norm
+
+STATIONARITY_TESTS = ("adf", "kpss")
+
+STATIONARITY_COLUMNS = [
+    "statistic", "p_value", "lags", "n_obs", "critical_1%", "critical_2.5%",
+    "critical_5%", "critical_10%", "stationary", "error"
+]
 
 
 class color:
@@ -20,12 +35,151 @@ class color:
     END = '\033[0m'
 
 
-def plot_acf_and_pacf(ts: pd.Series) -> None:
+class Autocorrelations(NamedTuple):
+    """ACF and PACF of a batch of series, one row per series."""
+    acf: np.ndarray
+    acf_band: np.ndarray
+    pacf: np.ndarray
+    pacf_band: np.ndarray
+    n_obs: int
+
+
+def default_nlags(n_obs: int) -> int:
+    """The number of lags `statsmodels` plots by default."""
+    return max(1, min(int(np.ceil(10 * np.log10(n_obs))), n_obs // 2 - 1))
+
+
+def batch_acf(data: np.ndarray, nlags: int) -> np.ndarray:
+    """
+    Autocorrelation function of each row of a (series x time) array,
+    up to `nlags`, via the FFT (as `tsa.acf(x, fft=True)`).
+    """
+    n_obs = data.shape[1]
+    demeaned = data - data.mean(axis=1, keepdims=True)
+
+    # zero-pad to avoid the circular correlation wrapping around
+    n_fft = 1 << (2 * n_obs - 1).bit_length()
+    spectrum = np.fft.rfft(demeaned, n=n_fft, axis=1)
+    autocovariance = np.fft.irfft(
+        spectrum * np.conj(spectrum), n=n_fft, axis=1
+    )[:, :nlags + 1]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return autocovariance / autocovariance[:, :1]
+
+
+def batch_pacf(acf: np.ndarray) -> np.ndarray:
+    """
+    Partial autocorrelation function of each row of an ACF array, via the
+    Durbin-Levinson recursion (as `tsa.pacf(x, method="ldb")`).
+    The recursion runs over lags, each step on all the series at once.
+    """
+    n_series, n_lags = acf.shape[0], acf.shape[1] - 1
+
+    pacf = np.ones_like(acf)
+    # phi[:, j] are the coefficients of the AR(k) fitted at step k
+    phi = np.zeros_like(acf)
+    for k in range(1, n_lags + 1):
+        previous = phi[:, 1:k]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            phi_kk = (
+                acf[:, k] - (previous * acf[:, k - 1:0:-1]).sum(axis=1)
+            ) / (1 - (previous * acf[:, 1:k]).sum(axis=1))
+        phi[:, 1:k] = previous - phi_kk[:, None] * previous[:, ::-1]
+        phi[:, k] = phi_kk
+        pacf[:, k] = phi_kk
+
+    return pacf
+
+
+def autocorrelations(
+    data: Union[np.ndarray, pd.Series, pd.DataFrame],
+    nlags: Optional[int] = None,
+    alpha: float = 0.05
+) -> Autocorrelations:
+    """
+    Computes ACF and PACF, with confidence bands, of many series at once.
+
+    Args:
+    data: a 2-D (series x time) array, or a Series, or a wide DataFrame
+    (one column per series, e.g. per station). All series must have the
+    same length and no missing values.
+
+    nlags (int, optional): defaults to `default_nlags`.
+
+    alpha (float, optional): the confidence bands are (1 - alpha).
+
+    Returns:
+    [Autocorrelations]: `acf` and `pacf` are (series x nlags + 1) arrays,
+    lag zero included; `acf_band` and `pacf_band` are the half-widths of
+    the bands around zero (Bartlett's formula for the ACF, 1 / sqrt(n)
+    for the PACF), as drawn by `statsmodels` plots.
+    """
+    if isinstance(data, pd.Series):
+        values = data.to_numpy(dtype=float)[None, :]
+    elif isinstance(data, pd.DataFrame):
+        values = data.to_numpy(dtype=float).T
+    else:
+        values = np.atleast_2d(np.asarray(data, dtype=float))
+
+    if np.isnan(values).any():
+        raise ValueError("The series must not contain missing values")
+
+    n_obs = values.shape[1]
+    nlags = default_nlags(n_obs) if nlags is None else nlags
+    z = norm.ppf(1 - alpha / 2)
+
+    acf = batch_acf(values, nlags)
+
+    # Bartlett's formula: var(r_k) = (1 + 2 * sum_{j < k} r_j^2) / n
+    acf_variance = np.ones_like(acf) / n_obs
+    acf_variance[:, 0] = 0
+    acf_variance[:, 2:] *= 1 + 2 * np.cumsum(acf[:, 1:-1] ** 2, axis=1)
+
+    pacf = batch_pacf(acf)
+    pacf_band = np.full_like(pacf, z / np.sqrt(n_obs))
+    pacf_band[:, 0] = 0
+
+    return Autocorrelations(
+        acf=acf,
+        acf_band=z * np.sqrt(acf_variance),
+        pacf=pacf,
+        pacf_band=pacf_band,
+        n_obs=n_obs
+    )
+
+
+def _plot_correlogram(
+    values: np.ndarray,
+    band: np.ndarray,
+    title: str,
+    ax: plt.Axes
+) -> None:
+    # draw like `statsmodels.graphics.tsaplots`: stems and a shaded band
+    lags = np.arange(len(values))
+    ax.vlines(lags, 0, values)
+    ax.plot(lags, values, marker="o", linestyle="none")
+    ax.axhline(0, color="black", linewidth=1)
+    ax.fill_between(lags, -band, band, alpha=0.25, linewidth=0)
+    ax.set_title(title)
+
+
+def plot_acf_and_pacf(
+    ts: pd.Series,
+    nlags: Optional[int] = None,
+    correlations: Optional[Autocorrelations] = None
+) -> None:
     """Plots pd.Series autocorrelation (ACF)
-    and partial-autocorrelation function (PACF)."""
+    and partial-autocorrelation function (PACF).
+    They can be passed already computed (see `autocorrelations`)."""
+    if correlations is None:
+        correlations = autocorrelations(ts, nlags)
+
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
-    plot_acf(ts, title="Autocorrelation (95% CI)", ax=ax1)
-    plot_pacf(ts, title="Partial Autocorrelation (95% CI)", ax=ax2)
+    _plot_correlogram(correlations.acf[0], correlations.acf_band[0],
+                      "Autocorrelation (95% CI)", ax1)
+    _plot_correlogram(correlations.pacf[0], correlations.pacf_band[0],
+                      "Partial Autocorrelation (95% CI)", ax2)
     plt.show()
 
 
@@ -72,3 +226,135 @@ def perform_adfuller(ts: pd.Series, regression: str = "ct") -> None:
     #         We reject the null hypothesis at the {key} level.
     #         The series appears to be stationary.
     #         """)
+
+
+def long_to_wide(
+    data: pd.DataFrame,
+    id_col: str = "stazione_partenza",
+    value_col: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Pivots the long layout of the rentals views (one row per station and
+    date, dates in the index, as returned by `retrieve_daily_rentals`)
+    to a wide DataFrame with one column per station. The values are
+    `value_col`, by default the column starting with "noleggi".
+    """
+    if value_col is None:
+        value_col = next(
+            col for col in data.columns if col.startswith("noleggi")
+        )
+    return data.pivot(columns=id_col, values=value_col)
+
+
+def _run_stationarity_tests(
+    task: Tuple[Any, np.ndarray, Sequence[str], str, float]
+) -> List[Dict[str, Any]]:
+    """Runs the stationarity tests on one series (in a worker process)."""
+    name, values, tests, regression, alpha = task
+    values = values[~np.isnan(values)]
+
+    rows = []
+    for test in tests:
+        row: Dict[str, Any] = {"series": name, "test": test}
+        try:
+            with warnings.catch_warnings():
+                # KPSS warns when the statistic is outside of its tables
+                warnings.simplefilter("ignore")
+                if test == "adf":
+                    statistic, p_value, lags, n_obs, critical, _ = \
+                        tsa.adfuller(values, regression=regression)
+                    stationary = p_value < alpha
+                else:
+                    statistic, p_value, lags, critical = \
+                        tsa.kpss(values, regression=regression, nlags="auto")
+                    n_obs = len(values)
+                    stationary = p_value > alpha
+        except (ValueError, np.linalg.LinAlgError) as error:
+            row.update({"n_obs": len(values), "error": str(error)})
+            rows.append(row)
+            continue
+
+        row.update({
+            "statistic": statistic,
+            "p_value": p_value,
+            "lags": lags,
+            "n_obs": n_obs,
+            **{f"critical_{level}": value for level, value in critical.items()},
+            "stationary": stationary,
+        })
+        rows.append(row)
+
+    return rows
+
+
+def stationarity_tests(
+    data: pd.DataFrame,
+    tests: Sequence[str] = STATIONARITY_TESTS,
+    regression: str = "ct",
+    alpha: float = 0.05,
+    n_jobs: Optional[int] = None,
+    id_col: Optional[str] = None,
+    value_col: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Runs the ADF and/or KPSS tests on many series at once, in parallel.
+
+    The null hypothesis of the ADF test is that there is a unit root
+    (the series is stationary if p-value < alpha), the one of KPSS is
+    that the series is stationary (it is if p-value > alpha).
+    Missing values are dropped from each series before testing.
+
+    Args:
+    data (pd.DataFrame): a wide DataFrame, one column per series (e.g.
+    per station or cluster), or the long layout of the rentals views
+    if `id_col` is given (see `long_to_wide`): `value_col` then defaults
+    to the column starting with "noleggi".
+
+    tests (list, optional): "adf", "kpss" or both (the default).
+
+    regression (str, optional): "c" (constant) or "ct" (constant and
+    trend, the default, as in `perform_adfuller`).
+
+    alpha (float, optional): the size of the tests, for the verdict.
+
+    n_jobs (int, optional): number of worker processes. Defaults to the
+    number of CPUs; 1 runs the tests serially, in this process.
+
+    Returns:
+    [pd.DataFrame]: one row per series and test, with the statistic,
+    p-value, lags, number of observations, critical values and the
+    verdict (`stationary`). Series the test could not be run on have
+    missing results and the reason in the `error` column.
+    """
+    unknown = set(tests) - set(STATIONARITY_TESTS)
+    if unknown:
+        raise ValueError(f"Unknown stationarity tests: {sorted(unknown)}")
+
+    if id_col is not None:
+        data = long_to_wide(data, id_col=id_col, value_col=value_col)
+
+    tasks = [
+        (name, data[name].to_numpy(dtype=float), tests, regression, alpha)
+        for name in data.columns
+    ]
+
+    if n_jobs == 1:
+        results = map(_run_stationarity_tests, tasks)
+        rows = [row for result in results for row in result]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = executor.map(
+                _run_stationarity_tests, tasks,
+                chunksize=max(1, len(tasks) // (4 * (n_jobs or 8)))
+            )
+            rows = [row for result in results for row in result]
+
+    if not rows:
+        return pd.DataFrame(
+            columns=STATIONARITY_COLUMNS,
+            index=pd.MultiIndex.from_tuples([], names=["series", "test"])
+        )
+
+    return pd.DataFrame(rows) \
+        .set_index(["series", "test"]) \
+        .reindex(columns=STATIONARITY_COLUMNS)
@@ -0,0 +1,28 @@
+import io
+import time
+
+import numpy as np
+
+from custom_functions.bulk_loader import _BlocksReader
+
+
+def test_blocks_reader_streams_large_blocks():
+    rng = np.random.default_rng(0)
+    blocks = [
+        rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        for size in (30_000_000, 1, 5_000_000)
+    ]
+    reader = io.BufferedReader(_BlocksReader(iter(blocks)))
+
+    start = time.perf_counter()
+    chunks = []
+    # copy_expert() reads 8 KB at a time
+    while True:
+        chunk = reader.read(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    seconds = time.perf_counter() - start
+
+    assert b"".join(chunks) == b"".join(blocks)
+    assert seconds < 2
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from custom_functions.calendar_features import (
+    calendar_features,
+    cached_calendar_features,
+    clear_calendar_cache,
+)
+
+FEATURES = ["hour", "day", "month", "holidays"]
+
+
+def test_permuted_index_gets_its_own_features():
+    clear_calendar_cache()
+    index = pd.DatetimeIndex(
+        ["2016-01-01 08:00", "2016-06-15 13:00", "2016-12-25 20:00"]
+    )
+    reversed_index = index[::-1]
+    # no frequency, so the timestamps are part of the cache key
+    assert index.freq is None and reversed_index.freq is None
+
+    cached_calendar_features(index, FEATURES)
+    features = cached_calendar_features(reversed_index, FEATURES)
+
+    pd.testing.assert_frame_equal(
+        features, calendar_features(reversed_index, FEATURES)
+    )
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from custom_functions.clustering import update_clusters
+from custom_functions.layer_store import MILAN_DATA, get_layer
+
+COORDINATES = ["longitudine", "latitudine"]
+
+
+def test_update_clusters_after_removal_only():
+    clusters = pd.read_csv(
+        MILAN_DATA / "bikemi-selected_stalls-clusters.csv",
+        index_col="numero_stazione"
+    )
+    nils = get_layer("nil") \
+        .rename(columns={"ID_NIL": "id_nil", "NIL": "nil"}) \
+        .set_index("id_nil")
+    removed = clusters.index[0]
+    stations = clusters[["nome_stazione", *COORDINATES]].drop(index=removed)
+
+    update = update_clusters(clusters, stations, nils)
+
+    assert update.diff.index.tolist() == [removed]
+    assert update.diff.loc[removed, "change"] == "removed"
+    assert update.diff.loc[removed, "old_cluster"] == \
+        clusters.loc[removed, "cluster"]
+    assert np.isnan(update.diff.loc[removed, "new_cluster"])
+
+    # the stations that stay keep their virtual stall
+    assert update.clusters.index.equals(stations.index)
+    assert (update.clusters["cluster"] == clusters["cluster"]
+            .drop(index=removed)).all()
+
+    # the centroid of the virtual stall that lost a station is the mean of
+    # the remaining members; the other centroids do not change
+    cluster = clusters.loc[removed, "cluster"]
+    members = update.clusters[update.clusters["cluster"] == cluster]
+    np.testing.assert_allclose(
+        members[["lon_cluster", "lat_cluster"]].to_numpy(),
+        np.tile(members[COORDINATES].mean().to_numpy(), (len(members), 1))
+    )
+    others = update.clusters["cluster"] != cluster
+    pd.testing.assert_frame_equal(
+        update.clusters.loc[others, ["lon_cluster", "lat_cluster"]],
+        clusters.drop(index=removed)
+        .loc[others, ["lon_cluster", "lat_cluster"]]
+    )
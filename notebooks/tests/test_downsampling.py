@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from custom_functions.downsampling import downsample, downsample_indices
+
+
+def test_downsample_frame_keeps_at_most_n_out_rows():
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2015-06-01", periods=26_000, freq="h")
+    frame = pd.DataFrame(
+        rng.poisson(3, (len(index), 5)).astype(float), index=index
+    )
+
+    for method in ("lttb", "minmax"):
+        assert len(downsample(frame, 2_000, method)) <= 2_000
+
+
+def test_downsample_indices_counts_gaps_in_budget():
+    rng = np.random.default_rng(0)
+    y = rng.normal(size=20_000)
+    y[rng.random(len(y)) < 0.5] = np.nan
+    x = np.arange(len(y), dtype=float)
+
+    for n_out in (10, 100, 2_000):
+        kept = downsample_indices(x, y, n_out)
+        assert len(kept) <= n_out
+        # some gaps are still drawn as such
+        assert np.isnan(y[kept]).any()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from custom_functions.time_series_functions import (
+    STATIONARITY_COLUMNS,
+    stationarity_tests,
+)
+
+
+def long_rentals(n_days=120, stations=("Duomo", "Cadorna")):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2016-01-01", periods=n_days, freq="D")
+    return pd.DataFrame({
+        "stazione_partenza": np.repeat(stations, n_days),
+        "numero_stazione_prelievo": np.repeat(
+            np.arange(len(stations)), n_days
+        ),
+        "noleggi_giornalieri": rng.poisson(50, n_days * len(stations)),
+    }, index=pd.Index(np.tile(dates, len(stations)), name="data"))
+
+
+def test_long_layout_tests_the_rentals_only():
+    results = stationarity_tests(
+        long_rentals(), n_jobs=1, id_col="stazione_partenza"
+    )
+
+    assert set(results.index) == {
+        (station, test)
+        for station in ("Duomo", "Cadorna") for test in ("adf", "kpss")
+    }
+
+
+def test_empty_frame_gives_empty_results():
+    results = stationarity_tests(
+        long_rentals().iloc[:0], n_jobs=1, id_col="stazione_partenza"
+    )
+
+    assert results.empty
+    assert list(results.columns) == STATIONARITY_COLUMNS
+    assert results.index.names == ["series", "test"]